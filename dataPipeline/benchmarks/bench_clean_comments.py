@@ -0,0 +1,116 @@
+"""
+clean_comments throughput, comments/sec: the old per-comment loop (noun_nlp(text) with every
+component, stopwords + WordNetLemmatizer rebuilt per call) vs nlp.pipe with NER only.
+
+    python -m benchmarks.bench_clean_comments [--n 2000] [--untrained]
+
+--untrained builds a pipeline with the same components as en_core_web_sm (tok2vec, tagger,
+parser, attribute_ruler, lemmatizer, ner) on random weights, for machines without the model.
+Compute per token is the same, entities are not. The token stage needs the NLTK stopwords and
+wordnet corpora and is skipped without them. Nothing is written to the database.
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import spacy
+from services.nlp_engine import NER_UNUSED, NLPEngine
+
+WORDS = ("genz protest kathmandu youth government nepal corruption balen shah rights curfew "
+         "parliament police students future leaders social media ban clash singhadurbar "
+         "we want change now this is our country why are they silent the people deserve better "
+         "love from pokhara respect to all who joined peaceful stay safe everyone").split()
+
+
+def make_comments(n, seed=0):
+    rnd = random.Random(seed)
+    return [
+        " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(5, 60))).capitalize()
+        + rnd.choice([".", "!", "?", " https://youtu.be/x", " <br> 🇳🇵"])
+        for _ in range(n)
+    ]
+
+
+def untrained_pipeline():
+    from spacy.cli.init_config import init_config
+
+    config = init_config(lang="en", optimize="efficiency",
+                         pipeline=["tagger", "parser", "attribute_ruler", "lemmatizer", "ner"])
+    nlp = spacy.util.load_model_from_config(config, auto_fill=True)
+    nlp.get_pipe("tagger").add_label("NN")
+    nlp.get_pipe("parser").add_label("nsubj")
+    nlp.get_pipe("ner").add_label("PERSON")
+    nlp.initialize()
+    return nlp
+
+
+def old_tokens(merged):
+    # token stage as it was: stopwords and lemmatizer built for every comment
+    from nltk.corpus import stopwords
+    from nltk.stem import WordNetLemmatizer
+
+    lem = WordNetLemmatizer()
+    stops = set(stopwords.words("english"))
+    clean = re.sub(r"[^a-zA-Z_\s]", " ", merged.lower())
+    clean = re.sub(r"\s+", " ", clean).strip()
+    return " ".join(lem.lemmatize(w) for w in clean.split() if w not in stops and len(w) > 2)
+
+
+def run_old(nlp, texts, tokens):
+    out = []
+    for text in texts:
+        merged = NLPEngine._merge_doc(nlp(NLPEngine._pre_clean(text)))
+        out.append(old_tokens(merged) if tokens else merged)
+    return out
+
+
+def run_new(nlp, texts, tokens, batch_size):
+    raws = [NLPEngine._pre_clean(text) for text in texts]
+    unused = [p for p in NER_UNUSED if p in nlp.pipe_names]
+    out = []
+    for doc in nlp.pipe(raws, batch_size=batch_size, disable=unused):
+        merged = NLPEngine._merge_doc(doc)
+        out.append(NLPEngine._tokens(merged) if tokens else merged)
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--n", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--untrained", action="store_true")
+    args = parser.parse_args()
+
+    nlp = untrained_pipeline() if args.untrained else spacy.load("en_core_web_sm")
+    try:
+        old_tokens("warm up the corpora")
+        tokens = True
+    except LookupError:
+        tokens = False
+        print("NLTK corpora missing -> timing the spaCy + entity merge stage only")
+
+    texts = make_comments(args.n)
+    n_tokens = sum(len(t.split()) for t in texts)
+    print(f"spaCy {spacy.__version__}, pipeline {nlp.pipe_names}, {args.n} comments, {n_tokens} words")
+
+    start = time.perf_counter()
+    old = run_old(nlp, texts, tokens)
+    t_old = time.perf_counter() - start
+
+    start = time.perf_counter()
+    new = run_new(nlp, texts, tokens, args.batch_size)
+    t_new = time.perf_counter() - start
+
+    same = sum(a == b for a, b in zip(old, new))
+    print(f"before: {args.n / t_old:8.1f} comments/s ({t_old:.2f}s)")
+    print(f"after:  {args.n / t_new:8.1f} comments/s ({t_new:.2f}s)  {t_old / t_new:.1f}x")
+    print(f"identical output: {same}/{args.n}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+DAG file parse time and parser-process memory, per git revision.
+
+    python -m benchmarks.bench_dag_parse --revs <before-rev> <after-rev> [--repeat 5]
+
+Every revision's dataPipeline/ is exported with `git archive` and dags/genz_dag.py is loaded
+with DagBag in a fresh interpreter (like the scheduler's DAG file processor), --repeat times.
+Memory is the RSS growth of that process while parsing, on top of an already imported airflow.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+
+REPO = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+CHILD = r"""
+import json, sys, time
+def rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * 4096 / 2**20
+from airflow.models.dagbag import DagBag
+base = rss_mb()
+start = time.perf_counter()
+bag = DagBag(dag_folder=sys.argv[1], include_examples=False, safe_mode=False)
+took = time.perf_counter() - start
+print(json.dumps({"parse_s": took, "rss_mb": rss_mb() - base,
+                  "dags": sorted(bag.dag_ids), "errors": {k: v[:200] for k, v in bag.import_errors.items()}}))
+"""
+
+
+def export(rev, dest):
+    archive = subprocess.run(["git", "-C", REPO, "archive", rev, "dataPipeline"],
+                             check=True, capture_output=True).stdout
+    with tempfile.TemporaryFile() as f:
+        f.write(archive)
+        f.seek(0)
+        with tarfile.open(fileobj=f) as tar:
+            tar.extractall(dest)
+    return os.path.join(dest, "dataPipeline")
+
+
+def measure(tree, airflow_home):
+    env = {
+        **os.environ,
+        "PYTHONPATH": tree,
+        "AIRFLOW_HOME": airflow_home,
+        "AIRFLOW__CORE__LOAD_EXAMPLES": "False",
+        "PYTHONWARNINGS": "ignore",
+    }
+    out = subprocess.run([sys.executable, "-c", CHILD, os.path.join(tree, "dags", "genz_dag.py")],
+                         env=env, cwd=tree, check=True, capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DAG parse time / memory per git revision")
+    parser.add_argument("--revs", nargs="+", default=["HEAD"])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        airflow_home = os.path.join(tmp, "airflow_home")
+        os.makedirs(airflow_home)
+        print(f"{'rev':>12} {'parse s (median)':>17} {'rss MB (median)':>16}  dags / errors")
+        for rev in args.revs:
+            tree = export(rev, os.path.join(tmp, rev.replace("/", "_").replace("^", "_parent")))
+            runs = [measure(tree, airflow_home) for _ in range(args.repeat)]
+            parse_s = statistics.median(r["parse_s"] for r in runs)
+            rss = statistics.median(r["rss_mb"] for r in runs)
+            print(f"{rev:>12} {parse_s:>17.3f} {rss:>16.1f}  {runs[0]['dags']} {runs[0]['errors'] or ''}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Embedding backend throughput (texts/sec) and parity with eager torch: torch, onnx, onnx-int8.
+
+    python -m benchmarks.bench_embed_backends [--texts 256] [--batch-size 32]
+
+Uses /bert_model when present (the image bakes bert-base-uncased there), otherwise a randomly
+initialised BertModel with bert-base dimensions: same compute, meaningless vectors.
+Exports go to a temp dir, the real ONNX cache is not touched.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import torch
+from transformers import BertConfig, BertModel
+from services import embed_backends
+from services.embed_backends import OnnxBackend, TorchBackend
+
+
+def load_model():
+    if os.path.exists("/bert_model"):
+        return BertModel.from_pretrained("/bert_model", local_files_only=True), "bert-base-uncased (/bert_model)"
+    torch.manual_seed(0)
+    return BertModel(BertConfig()), "random init, bert-base dims"
+
+
+def make_batches(n_texts, batch_size, vocab_size, seed=0):
+    gen = torch.Generator().manual_seed(seed)
+    lengths = sorted(torch.randint(16, 129, (n_texts,), generator=gen).tolist())
+    batches = []
+    for i in range(0, n_texts, batch_size):
+        lens = lengths[i:i + batch_size]
+        ids = torch.randint(1000, vocab_size, (len(lens), max(lens)), generator=gen)
+        mask = torch.zeros_like(ids)
+        for j, n in enumerate(lens):
+            mask[j, :n] = 1
+        batches.append({"input_ids": ids * mask, "attention_mask": mask, "token_type_ids": torch.zeros_like(ids)})
+    return batches
+
+
+def pooled(hidden, mask):
+    m = mask.unsqueeze(-1)
+    return (hidden * m).sum(dim=1) / m.sum(dim=1)
+
+
+def run(backend, batches):
+    backend.last_hidden_state(batches[0])   # warm up
+    start = time.perf_counter()
+    out = [pooled(backend.last_hidden_state(b), b["attention_mask"]) for b in batches]
+    return time.perf_counter() - start, torch.cat(out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="embedding backend throughput and parity")
+    parser.add_argument("--texts", type=int, default=256)
+    parser.add_argument("--batch-size", type=int, default=32)
+    args = parser.parse_args()
+
+    model, label = load_model()
+    model.eval()
+    threads = torch.get_num_threads()
+    batches = make_batches(args.texts, args.batch_size, model.config.vocab_size)
+    print(f"{label}, {args.texts} texts (16-128 tokens), batch {args.batch_size}, {threads} threads")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        embed_backends.ONNX_DIR = tmp
+        base_s, base_vecs = run(TorchBackend(model), batches)
+        print(f"{'backend':>10} {'texts/s':>9} {'speedup':>8} {'min cos':>8} {'mean cos':>9}")
+        print(f"{'torch':>10} {args.texts / base_s:>9.1f} {1.0:>7.2f}x {1.0:>8.4f} {1.0:>9.4f}")
+        for quantize in (False, True):
+            backend = OnnxBackend(lambda: model, "bench", quantize=quantize, threads=threads)
+            took, vecs = run(backend, batches)
+            cos = torch.nn.functional.cosine_similarity(vecs, base_vecs, dim=-1)
+            print(f"{backend.name:>10} {args.texts / took:>9.1f} {base_s / took:>7.2f}x "
+                  f"{cos.min().item():>8.4f} {cos.mean().item():>9.4f}")
+
+
+if __name__ == "__main__":
+    main()
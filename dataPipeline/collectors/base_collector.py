@@ -2,6 +2,7 @@ import os
 import json
 from abc import ABC, abstractmethod
 from services.psql_conn import psql_cursor
+from schemas.etl_schema import execute_comment_watermarks_sql
 
 class BaseCollector(ABC):
     def __init__(self, platform):
@@ -25,6 +26,60 @@ class BaseCollector(ABC):
             exists = cursor.fetchone() is not None
             return exists
 
+    def filter_processed(self, vid_ids, bloom=None) -> set:
+        """
+        Bulk version of is_already_processed. Returns the subset of vid_ids that
+        already exist in processed_vidIds using a single query.
+        If a bloom filter is given, ids it reports as definitely new skip the DB.
+        """
+        candidates = list(dict.fromkeys(vid_ids))
+        if bloom is not None:
+            try:
+                # a bare key (e.g. only load's add_many since a redis flush) doesn't count as seeded
+                if not bloom.is_seeded():
+                    self._seed_bloom(bloom)
+                maybe = bloom.contains_many(candidates)
+                candidates = [v for v in candidates if maybe[v]]
+            except Exception as e:
+                # redis down -> fall back to asking postgres for everything
+                print(f"[Bloom] lookup failed, querying DB for all ids: {e}")
+
+        if not candidates:
+            return set()
+
+        with psql_cursor() as cursor:
+            cursor.execute(
+                "SELECT DISTINCT vid_id FROM processed_vidIds WHERE vid_id = ANY(%s);",
+                (candidates,)
+            )
+            return {row[0] for row in cursor.fetchall()}
+
+    def get_watermarks(self, vid_ids) -> dict:
+        """
+        Returns {vid_id: (last_published_at, last_cmt_id)} for videos that were ingested before.
+        last_published_at is an ISO string in the same format the API returns ("...Z").
+        """
+        if not vid_ids:
+            return {}
+        with psql_cursor() as cursor:
+            cursor.execute(execute_comment_watermarks_sql)
+            cursor.execute(
+                "SELECT vid_id, last_published_at, last_cmt_id FROM airflow.comment_watermarks WHERE vid_id = ANY(%s);",
+                (list(vid_ids),)
+            )
+            return {
+                vid: (published.strftime("%Y-%m-%dT%H:%M:%SZ"), cmt_id)
+                for vid, published, cmt_id in cursor.fetchall()
+            }
+
+    def _seed_bloom(self, bloom):
+        """Fill an empty filter with every known video id, otherwise old videos look new."""
+        with psql_cursor() as cursor:
+            cursor.execute("SELECT DISTINCT vid_id FROM processed_vidIds;")
+            vid_ids = [row[0] for row in cursor.fetchall()]
+        bloom.seed(vid_ids)
+        print(f"[Bloom] seeded filter with {len(vid_ids)} video ids")
+
     def mark_as_processed(self, item_id):
         """Add ID to the processed list to avoid duplicates next time."""
         processed_ids = []
@@ -44,4 +99,4 @@ class BaseCollector(ABC):
 
         # write back valid JSON (overwrite)
         with open(self.log_file, "w") as f:
-            json.dump(processed_ids, f)
\ No newline at end of file
+            json.dump(processed_ids, f)
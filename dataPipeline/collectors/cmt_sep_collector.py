@@ -1,16 +1,24 @@
 import re
-from psycopg2.extras import execute_values
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from langdetect import detect, DetectorFactory
-from schemas.etl_schema import insert_comment_lang
+from services.bulk_load import copy_merge
 
 DetectorFactory.seed = 0  # makes results stable
 
+# below this many unique texts a process pool costs more than it saves
+PARALLEL_MIN_TEXTS = 200
+LANG_CACHE_TTL = 30 * 24 * 60 * 60
+_LOCAL_CACHE_SIZE = 50000
+_local_cache = OrderedDict()   # text hash -> lang (LRU)
+
 def detect_language(text):
     try:
         lang = detect(text)
     except:
         return 'rne'
-    
+
     if lang == 'ne':
         return 'ne'
     elif lang == 'en':
@@ -18,14 +26,83 @@ def detect_language(text):
     else:
         return 'rne'
 
-def cmt_sep_collector(cursor, cmt: dict):
+def _text_hash(text):
+    return hashlib.sha1(str(text).encode("utf-8")).hexdigest()
+
+def _remember(h, lang):
+    _local_cache[h] = lang
+    _local_cache.move_to_end(h)
+    if len(_local_cache) > _LOCAL_CACHE_SIZE:
+        _local_cache.popitem(last=False)
+
+def detect_languages(cmt: dict, redis=None, max_workers=None) -> dict:
+    """
+    Batched language detection for {comment_id: comment_text} -> {comment_id: lang}.
+    Texts are deduplicated by content hash, looked up in the local LRU and
+    (optionally) redis, and only the misses are detected, in a process pool when there are enough.
+    """
+    by_hash = {}
+    for cid, txt in cmt.items():
+        by_hash.setdefault(_text_hash(txt), (txt, []))[1].append(cid)
+
+    langs = {}
+    for h in by_hash:
+        if h in _local_cache:
+            langs[h] = _local_cache[h]
+            _local_cache.move_to_end(h)
+
+    missing = [h for h in by_hash if h not in langs]
+    if missing and redis is not None:
+        try:
+            for h, lang in zip(missing, redis.mget([f"lang:{h}" for h in missing])):
+                if lang:
+                    langs[h] = lang
+                    _remember(h, lang)
+        except Exception as e:
+            print(f"[Lang] redis cache lookup failed: {e}")
+
+    missing = [h for h in by_hash if h not in langs]
+    texts = [by_hash[h][0] for h in missing]
+    detected = None
+    if len(texts) >= PARALLEL_MIN_TEXTS:
+        try:
+            with ProcessPoolExecutor(max_workers=max_workers) as pool:
+                detected = list(pool.map(detect_language, texts, chunksize=64))
+        except Exception as e:
+            # e.g. daemonic celery workers can't fork children
+            print(f"[Lang] process pool unavailable, detecting serially: {e}")
+    if detected is None:
+        detected = [detect_language(txt) for txt in texts]
+
+    for h, lang in zip(missing, detected):
+        langs[h] = lang
+        _remember(h, lang)
+
+    if missing and redis is not None:
+        try:
+            pipe = redis.pipeline(transaction=False)
+            for h in missing:
+                pipe.set(f"lang:{h}", langs[h], ex=LANG_CACHE_TTL)
+            pipe.execute()
+        except Exception as e:
+            print(f"[Lang] redis cache write failed: {e}")
+
+    print(f"[Lang] {len(cmt)} comments, {len(by_hash)} unique texts, {len(missing)} detected")
+    return {cid: langs[h] for h, (_txt, cids) in by_hash.items() for cid in cids}
+
+def cmt_sep_collector(cursor, cmt: dict, langs: dict = None):
     # cmt is a dict of {comment_id: comment_text}
-    rows = [(cid, detect_language(txt)) for cid, txt in cmt.items()]
+    # langs: languages detected beforehand (outside the transaction), detected here if missing
+    if langs is None:
+        langs = detect_languages(cmt)
+    rows = [(cid, langs.get(cid) or detect_language(txt)) for cid, txt in cmt.items()]
 
     # Upsert logic: Insert language, or update it if the row exists
-    execute_values(
+    copy_merge(
         cursor,
-        insert_comment_lang,
+        "airflow.comment_lang",
+        ["comment_id", "language"],
         rows,
-        page_size=1000
-    )
\ No newline at end of file
+        key_columns=["comment_id"],
+        on_conflict="DO UPDATE SET language = EXCLUDED.language",
+    )
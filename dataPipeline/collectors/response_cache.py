@@ -0,0 +1,127 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+class ResponseCache:
+    """
+    On-disk cache for API responses.
+    - key: hash of endpoint + request params
+    - value: gzip compressed JSON, one file per response
+    - per-endpoint TTL (seconds), LRU eviction once the folder grows past max_bytes
+    - enabled=False bypasses reads only, fresh responses still refresh the cache
+    """
+    DEFAULT_TTLS = {
+        "search": 6 * 60 * 60,
+        "commentThreads": 60 * 60,
+    }
+
+    def __init__(self, cache_dir, ttls=None, max_bytes=200 * 1024 * 1024, enabled=True):
+        self.cache_dir = cache_dir
+        self.ttls = {**self.DEFAULT_TTLS, **(ttls or {})}
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # running size of the folder, kept up to date by set/get so the folder is only listed when over budget
+        self._size = sum(size for _mtime, size, _path in self._entries())
+
+    def _path(self, endpoint, params):
+        raw = json.dumps({"endpoint": endpoint, "params": params}, sort_keys=True, default=str)
+        key = hashlib.sha256(raw.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, f"{endpoint}_{key}.json.gz")
+
+    def get(self, endpoint, params):
+        if not self.enabled:
+            return None
+        path = self._path(endpoint, params)
+        ttl = self.ttls.get(endpoint, 0)
+        try:
+            # written time lives in the file, mtime is used as the LRU clock
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                entry = json.load(f)
+            if time.time() - entry["stored_at"] > ttl:
+                self._remove(path)
+                raise FileNotFoundError(path)
+            os.utime(path, None)
+        except (OSError, ValueError, KeyError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return entry["response"]
+
+    def set(self, endpoint, params, response):
+        path = self._path(endpoint, params)
+        # pid + thread: tasks in other processes may write the same key into the same folder
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with gzip.open(tmp, "wt", encoding="utf-8") as f:
+            json.dump({"stored_at": time.time(), "response": response}, f)
+        size = os.path.getsize(tmp)
+        try:
+            replaced = os.path.getsize(path)
+        except OSError:
+            replaced = 0
+        os.replace(tmp, path)  # atomic, readers never see half-written files
+        with self._lock:
+            self._size += size - replaced
+            over = self._size > self.max_bytes
+        if over:
+            self._evict()
+
+    def _entries(self):
+        """(mtime, size, path) of every cached response"""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".json.gz"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def _remove(self, path):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return
+        with self._lock:
+            self._size -= size
+
+    def _evict(self):
+        with self._lock:
+            # the running size is only an estimate when other processes share the folder, recount it here
+            entries = self._entries()
+            total = sum(size for _mtime, size, _path in entries)
+            self._size = total
+            if total <= self.max_bytes:
+                return
+            # least recently used first
+            for _mtime, size, path in sorted(entries):
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                if total <= self.max_bytes:
+                    break
+            self._size = total
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
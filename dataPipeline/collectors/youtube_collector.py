@@ -1,21 +1,80 @@
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError # For catching specific API errors
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 import os
+import threading
+import time
 from .base_collector import BaseCollector
-from typing import List
+from .response_cache import ResponseCache
+from typing import List, Tuple
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket shared by all fetch workers.
+    rate: tokens (requests) added per second, capacity: max burst size
+    """
+    def __init__(self, rate: float, capacity: int = None):
+        self.rate = rate
+        self.capacity = capacity or max(1, int(rate))
+        self._tokens = float(self.capacity)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
 
 
 class YouTubeNepal(BaseCollector):
-    def __init__(self,api_key:str):
+    def __init__(self,api_key:str, use_cache: bool = True, cache_ttls: dict = None):
         super().__init__("youtube")
         self.api_key = api_key
+        self.cache = ResponseCache(os.path.join(self.base_path, "api_cache"), ttls=cache_ttls, enabled=use_cache)
         self.youtube = build("youtube", "v3", developerKey=self.api_key)
+        # googleapiclient (httplib2) is not thread-safe -> one client per worker thread
+        self._local = threading.local()
+        self.rate_limiter = None
+        self.quota_exceeded = threading.Event()
+        # incremental fetches that stopped before reaching their watermark (quota)
+        self.partial_fetches = set()
+
+    def _client(self):
+        if threading.current_thread() is threading.main_thread():
+            return self.youtube
+        if not hasattr(self._local, "youtube"):
+            self._local.youtube = build("youtube", "v3", developerKey=self.api_key)
+        return self._local.youtube
+
+    def _throttle(self):
+        if self.rate_limiter:
+            self.rate_limiter.acquire()
+
+    def _execute(self, endpoint: str, **params):
+        """Runs <endpoint>().list(**params), served from the response cache when possible."""
+        cached = self.cache.get(endpoint, params)
+        if cached is not None:
+            return cached
+        self._throttle()
+        response = getattr(self._client(), endpoint)().list(**params).execute()
+        self.cache.set(endpoint, params, response)
+        return response
         
     def _handle_quota_error(self, e):
         if e.resp.status in [403, 429] and "quotaExceeded" in str(e):
             print("CRITICAL: Youtube API Quota Limit Exceeded!")
             print("Check Google Cloud Console. ETL will resume once quota resets")
+            # signal every other worker to stop issuing requests
+            self.quota_exceeded.set()
             return True
         return False
 
@@ -31,7 +90,8 @@ class YouTubeNepal(BaseCollector):
             page_token = None
 
             while True:
-                response = self.youtube.search().list(
+                response = self._execute(
+                    "search",
                     # q=query,
                     q=f"\"{query}\" -shorts",
                     part="id,snippet",
@@ -41,7 +101,7 @@ class YouTubeNepal(BaseCollector):
                     maxResults=min(50, max_results - len(vid_ids)),
                     regionCode="NP",
                     pageToken = page_token,
-                ).execute()
+                )
                 vid_ids.extend(
                     item["id"]["videoId"]
                     for item in response.get("items", [])
@@ -62,37 +122,117 @@ class YouTubeNepal(BaseCollector):
             print(f"[YT] SEARCH ERROR: {e}")
             return []
 
-    def fetch_data(self, video_id, cmt_per_vid: int = 500):
+    @staticmethod
+    def _published_at(item):
+        return item.get("snippet", {}).get("topLevelComment", {}).get("snippet", {}).get("publishedAt", "")
+
+    def fetch_data(self, video_id, cmt_per_vid: int = 500, watermark=None, on_page=None):
+        """
+        watermark: (last_published_at, last_cmt_id) of the newest comment already stored.
+        When given, comments are read newest first and paging continues until the watermark
+        (cmt_per_vid does not apply), so the whole delta since the last run is fetched.
+        If paging stops earlier (quota) the comments fetched so far are returned and the
+        video is added to partial_fetches: there is a gap below the oldest fetched comment,
+        so its watermark must not move.
+        on_page: optional callback(video_id, items) that receives every page as it arrives
+        instead of collecting it (the returned list stays empty).
+        """
         print(f"[YT] ---> STARTING FETCH FOR VIDEO: {video_id}") # LOG TEST
+        comments = []
+        n_fetched = 0
+        page_token = None
+        reached_watermark = False
         try:
-            comments = []
-            page_token = None
             while True:
-                response = self.youtube.commentThreads().list(
+                if self.quota_exceeded.is_set():
+                    print(f"[YT] STOPPING {video_id}: quota already exceeded")
+                    break
+                response = self._execute(
+                    "commentThreads",
                     part="snippet",
                     videoId=video_id,
-                    maxResults=min(100, cmt_per_vid - len(comments)),
+                    maxResults=100 if watermark else min(100, cmt_per_vid - n_fetched),
                     textFormat="plainText",
-                    order='relevance', 
+                    order='time' if watermark else 'relevance', 
                     pageToken = page_token,
-                ).execute()
-                comments.extend(response.get("items", []))
+                )
+                items = response.get("items", [])
+                if watermark:
+                    last_published, last_id = watermark
+                    page = []
+                    for item in items:
+                        # ISO-8601 "Z" strings compare chronologically
+                        if item["id"] == last_id or self._published_at(item) < last_published:
+                            reached_watermark = True
+                            break
+                        page.append(item)
+                else:
+                    page = items
+
+                n_fetched += len(page)
+                if on_page is None:
+                    comments.extend(page)
+                elif page:
+                    on_page(video_id, page)
 
                 page_token = response.get("nextPageToken")
-                if not page_token or len(comments) >= cmt_per_vid:
+                if reached_watermark or not page_token:
+                    break
+                # first fetch of a video (no watermark yet) is capped at cmt_per_vid
+                if not watermark and n_fetched >= cmt_per_vid:
                     break
 
-            print(f"[YT] Collected {len(comments)} comments for {video_id}")
+            # more pages left and the watermark not reached -> comments were skipped
+            if watermark and not reached_watermark and page_token:
+                self.partial_fetches.add(video_id)
+                print(f"[YT] {video_id}: stopped before the watermark, keeping it")
+            print(f"[YT] Collected {n_fetched} comments for {video_id}")
             return comments
 
         except HttpError as e:
             if self._handle_quota_error(e): # Check for quota here
+                if watermark and n_fetched:
+                    # keep the newest part of the delta, the rest comes with the next run
+                    self.partial_fetches.add(video_id)
+                    print(f"[YT] {video_id}: quota hit before the watermark, keeping it")
+                    return comments
                 return []
             if e.resp.status == 403:
                 print(f"[YT] SKIPPING: Comments are disabled for video {video_id}")
             else:
                 print(f"[YT] API ERROR ({e.resp.status}): {e}")
-            return []
         except Exception as e:
             print(f"[YT] UNKNOWN ERROR: {e}")
-            return []
\ No newline at end of file
+        # streamed pages are already handed over, their video must keep its old watermark
+        if on_page is not None and watermark and n_fetched:
+            self.partial_fetches.add(video_id)
+        return []
+
+    def fetch_many(self, video_ids: List[str], cmt_per_vid: int = 500,
+                   max_workers: int = 8, req_per_sec: float = 10,
+                   watermarks: dict = None, on_page=None) -> List[Tuple[str, list]]:
+        """
+        Fetches comments for many videos concurrently through a bounded worker pool.
+        All workers share one token bucket; once a quota error is seen the remaining
+        workers stop before their next request.
+        watermarks: optional {video_id: (last_published_at, last_cmt_id)} for incremental fetches
+        on_page: optional callback(video_id, items), called from the worker threads for every
+        page as it arrives; the comment lists returned are then empty (see fetch_data)
+        Returns [(video_id, comments)] in the same order as video_ids.
+        """
+        watermarks = watermarks or {}
+        if not video_ids:
+            return []
+
+        self.rate_limiter = TokenBucket(req_per_sec)
+        self.partial_fetches = set()
+        try:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(video_ids))) as pool:
+                # map keeps input order regardless of completion order
+                results = list(pool.map(lambda vid: self.fetch_data(vid, cmt_per_vid, watermarks.get(vid), on_page), video_ids))
+        finally:
+            self.rate_limiter = None
+
+        if self.quota_exceeded.is_set():
+            print("[YT] Quota exceeded during concurrent fetch, results are partial")
+        return list(zip(video_ids, results))
\ No newline at end of file
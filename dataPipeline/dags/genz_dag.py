@@ -1,19 +1,49 @@
 from airflow.decorators import dag, task
+import os
+import threading
 import pendulum
 from pendulum import datetime
 from airflow.operators.python import get_current_context
 from airflow.operators.trigger_dagrun import TriggerDagRunOperator
 from schemas.etl_schema import (execute_comments_sql, execute_topic_sql, execute_processed_vidIds_sql, 
-                                insert_comments_sql, insert_topic_sql, insert_processed_vidIds_sql,
-                                update_topic_sql,execute_cleaned_comments_sql
+                                merge_topic_on_conflict_sql, execute_cleaned_comments_sql,
+                                execute_comment_watermarks_sql, upsert_comment_watermarks_sql
                                 )
-from collectors.youtube_collector import YouTubeNepal
-from collectors.cmt_sep_collector import cmt_sep_collector
+from psycopg2.extras import execute_values
+from collectors.cmt_sep_collector import cmt_sep_collector, detect_languages
 from airflow.exceptions import AirflowSkipException
-from services.psql_conn import psql_cursor
-from services.redis_client import get_redis
+from services.psql_conn import psql_cursor, pool_stats
+from services.bulk_load import copy_merge, pg_array
+from services.redis_client import get_redis, processed_bloom, add_run_state, get_run_state, clear_run_state
 from services.api_services import api_provider
-from services.run_embed import create_embeddings
+from services.lazy import lazy_import
+
+# heavy modules (googleapiclient, torch, transformers, spacy) load inside the tasks, not at parse time
+youtube_collector = lazy_import("collectors.youtube_collector")
+run_embed = lazy_import("services.run_embed")
+
+STAGE_COLUMNS = ["vid_id", "id", "comment", "author", "p_timestamp"]
+
+
+def _staged_rows(vidId, items):
+    # keep only the fields load uses
+    for item in items:
+        snippet = item.get("snippet", {}).get("topLevelComment", {}).get("snippet")
+        if snippet:
+            yield {
+                "vid_id": vidId,
+                "id": item["id"],
+                "comment": snippet["textDisplay"],
+                "author": snippet["authorDisplayName"],
+                "p_timestamp": snippet["publishedAt"],
+            }
+
+
+def _remove_run_staging(context):
+    # task failed for good (retries exhausted): drop the run's chunk files
+    from services.chunk_store import remove_staging
+    remove_staging(context["dag_run"].run_id)
+
 
 # --------------------- Comments Fetching Dag ----------------------------------
 @dag(
@@ -21,7 +51,9 @@ from services.run_embed import create_embeddings
     start_date=datetime(2023, 10, 1),
     schedule="@daily",
     catchup=False,
-    default_args={"retries": 1},
+    default_args={"retries": 1, "on_failure_callback": _remove_run_staging},
+    # redis state is scoped per run_id, so several topics can be ingested at once
+    # (up to [core] max_active_runs_per_dag)
     tags=["nepal", "genz"],
 )
 
@@ -33,11 +65,17 @@ def start_genz_dag():
             'topic': '',
             'max_results': 1,
             'cmt_per_vid': 15,
+            'fetch_workers': 8,
+            'req_per_sec': 10,
         }
         redis = get_redis()
         ctx = get_current_context()
         conf = (ctx.get('dag_run').conf or {})
         extract_info['topic'], extract_info['dag_id']  = conf.get('topic', 'genz'), conf.get('dag_id', 'genz_dag') 
+        extract_info['fetch_workers'] = conf.get('fetch_workers', extract_info['fetch_workers'])
+        extract_info['req_per_sec'] = conf.get('req_per_sec', extract_info['req_per_sec'])
+        # re-visit processed videos and fetch only comments newer than their watermark
+        incremental = conf.get('incremental', True)
         
         api_key = api_provider()
         if not api_key:
@@ -45,7 +83,8 @@ def start_genz_dag():
             context['ti'].xcom_push(key='skip_reason', value=reason)
             raise AirflowSkipException(reason)
 
-        collector = YouTubeNepal(api_key)
+        # dag_run.conf {"bypass_cache": true} forces fresh API calls
+        collector = youtube_collector.YouTubeNepal(api_key, use_cache=not conf.get('bypass_cache', False))
             
         # search videos
         vidIds = collector.search_videos(extract_info['topic'], extract_info['max_results'])
@@ -55,18 +94,75 @@ def start_genz_dag():
             print("No videos found.")
             return {'items': []}
 
-        all_items = []
+        # one bloom check + one query for every video id
+        already_processed = collector.filter_processed(vidIds, bloom=processed_bloom(redis))
+
+        watermarks = collector.get_watermarks(already_processed) if incremental else {}
+
+        new_vidIds, processed_ids, not_processed_ids = [], [], []
         for vidId in vidIds:
-            if collector.is_already_processed(vidId):
-                redis.sadd(f"processed:{extract_info['dag_id']}", vidId)
-                print(f"Skipping {vidId}: Already processed")
+            if vidId in already_processed:
+                processed_ids.append(vidId)
+                if vidId in watermarks:
+                    print(f"Incremental fetch for {vidId}: newer than {watermarks[vidId][0]}")
+                    new_vidIds.append(vidId)
+                else:
+                    print(f"Skipping {vidId}: Already processed")
                 continue
 
-            # api call
-            print(f"Data Fetching for: {vidId}")
             # not processed scenario
-            redis.sadd(f"not_processed:{extract_info['dag_id']}", vidId)
-            comments = collector.fetch_data(vidId, cmt_per_vid = extract_info['cmt_per_vid'])
+            not_processed_ids.append(vidId)
+            new_vidIds.append(vidId)
+
+        # one pipelined write, keyed by this run (load_data reads it back)
+        add_run_state(redis, ctx['dag'].dag_id, ctx['dag_run'].run_id,
+                      {"processed": processed_ids, "not_processed": not_processed_ids})
+
+        # dag_run.conf {"stage_chunks": true} -> pages go straight to parquet chunk files as they
+        # arrive (nothing is collected in memory), XCom only carries the paths
+        staged = conf.get('stage_chunks', False)
+        on_page = None
+        if staged:
+            from services.chunk_store import ChunkWriter, remove_staging, staging_dir
+
+            run_id = ctx['dag_run'].run_id
+            # a retried extract starts over, files of the failed try are not referenced anymore
+            remove_staging(run_id)
+            writer = ChunkWriter(staging_dir(run_id), "extract", columns=STAGE_COLUMNS)
+            write_lock = threading.Lock()
+
+            def on_page(vidId, items):
+                rows = list(_staged_rows(vidId, items))
+                with write_lock:
+                    writer.write(rows)
+
+        # api calls (concurrent, rate limited, stops on quota)
+        print(f"Data Fetching for: {new_vidIds}")
+        fetched = collector.fetch_many(
+            new_vidIds,
+            cmt_per_vid=extract_info['cmt_per_vid'],
+            max_workers=extract_info['fetch_workers'],
+            req_per_sec=extract_info['req_per_sec'],
+            watermarks=watermarks,
+            on_page=on_page,
+        )
+        # videos whose delta was cut short keep their old watermark (load_data skips them)
+        add_run_state(redis, ctx['dag'].dag_id, ctx['dag_run'].run_id,
+                      {"partial": collector.partial_fetches})
+
+        if staged:
+            print(f"[YT] API cache stats: {collector.cache.stats()}")
+            chunks = writer.close()
+            if not writer.rows:
+                remove_staging(run_id)
+                reason = "No comments found!"
+                context['ti'].xcom_push(key='skip_reason', value=reason)
+                raise AirflowSkipException(reason)
+            print(f"[YT] staged {writer.rows} comments in {len(chunks)} chunks")
+            return {'chunks': chunks}
+
+        all_items = []
+        for vidId, comments in fetched:
             if comments:
                 all_items.extend([
                     {
@@ -81,6 +177,8 @@ def start_genz_dag():
             else:
                 print(f"No data retrieved for {vidId}")
     
+        print(f"[YT] API cache stats: {collector.cache.stats()}")
+
         if not all_items:
             reason = "No comments found!"
             context['ti'].xcom_push(key='skip_reason', value=reason)
@@ -90,6 +188,10 @@ def start_genz_dag():
 
     @task
     def transform_data(extracted_data):
+        # staged chunks are already filtered at extract, t_timestamp is added at load
+        if "chunks" in extracted_data:
+            return extracted_data
+
         items = extracted_data.get("items", [])
 
         comments = []
@@ -137,77 +239,134 @@ def start_genz_dag():
 
         redis = get_redis()
 
-        # read redis state
-        processed_vids = redis.smembers(f"processed:{dag_id}")
-        not_processed_vids = redis.smembers(f"not_processed:{dag_id}")
+        # read redis state of this run
+        run_id = ctx["dag_run"].run_id
+        state = get_run_state(redis, dag_id, run_id, ["processed", "not_processed", "partial"])
+        processed_vids, not_processed_vids = state["processed"], state["not_processed"]
+        partial_vids = state["partial"]
 
+        # staged runs hand over chunk files, read them one chunk at a time
+        staged = isinstance(comments, dict) and "chunks" in comments
+        if staged:
+            from services.chunk_store import iter_chunks
+            t_timestamp = pendulum.now("Asia/Kathmandu")
+            batches = ([{**row, "t_timestamp": t_timestamp} for row in chunk]
+                       for chunk in iter_chunks(comments["chunks"]))
+            texts_per_chunk = ({val["id"]: val["comment"] for val in chunk} for chunk in iter_chunks(comments["chunks"]))
+        else:
+            batches = [comments]
+            texts_per_chunk = [{val["id"]: val["comment"] for val in comments}]
+
+        # language detection is slow -> do it before the transaction is opened,
+        # one chunk at a time, only the {id: lang} results are kept
+        langs = {}
+        try:
+            for texts in texts_per_chunk:
+                langs.update(detect_languages(texts, redis=redis))
+        except Exception as e:
+            print(f"Exception in detect_languages:- {e}")
+            langs = None
+
+        loaded_vids, delta_vids = set(), set()
         with psql_cursor() as cursor:
             # ensure tables exist
             cursor.execute(execute_comments_sql)
             cursor.execute(execute_topic_sql)
             cursor.execute(execute_cleaned_comments_sql)
             cursor.execute(execute_processed_vidIds_sql)
-            # insert comments
-            comment_values = [
-                (
-                    val["id"],
-                    val["comment"],
-                    val["author"],
-                    val["p_timestamp"],
-                    val["t_timestamp"],
-                )
-                for val in comments
-            ]
-
-            cursor.executemany(insert_comments_sql, comment_values)
-            try:
-                cmt_vals = {}
-                for val in comment_values: cmt_vals[val[0]] = val[1] # -> dict of key (id): value (comment)
-                cmt_sep_collector(cursor, cmt_vals)
-            except Exception as e:
-                print(f"Exception in cmt_sep_collector:- {e}")
-            finally:
-                # new videos → INSERT
-                new_topic_values = [
+            cursor.execute(execute_comment_watermarks_sql)
+            for comments in batches:
+                # insert comments
+                comment_values = [
                     (
                         val["id"],
-                        [topic],
-                        [collector],
-                        dag_id,
+                        val["comment"],
+                        val["author"],
+                        val["p_timestamp"],
+                        val["t_timestamp"],
                     )
                     for val in comments
-                    if val["vid_id"] in not_processed_vids
                 ]
 
-                cursor.executemany(insert_topic_sql, new_topic_values)
+                copy_merge(cursor, "airflow.comments",
+                           ["id", "comment", "author", "p_timestamp", "t_timestamp"],
+                           comment_values, key_columns=["id"])
+                try:
+                    cmt_vals = {}
+                    for val in comment_values: cmt_vals[val[0]] = val[1] # -> dict of key (id): value (comment)
+                    cmt_sep_collector(cursor, cmt_vals, langs)
+                except Exception as e:
+                    print(f"Exception in cmt_sep_collector:- {e}")
+                finally:
+                    # new videos and new comments of processed videos → INSERT
+                    new_topic_values = [
+                        (
+                            val["id"],
+                            pg_array([topic]),
+                            pg_array([collector]),
+                            dag_id,
+                        )
+                        for val in comments
+                        if (
+                            val["vid_id"] in not_processed_vids
+                            or val["vid_id"] in processed_vids
+                        )
+                    ]
+
+                    # merge, not DO NOTHING: comments already tagged (processed videos, or a concurrent
+                    # run for another topic) keep their topics and gain this one
+                    copy_merge(cursor, "airflow.topic_collector",
+                               ["id", "topic", "collector", "dag_id"],
+                               new_topic_values, key_columns=["id"],
+                               on_conflict=merge_topic_on_conflict_sql)
 
-                # processed videos → UPDATE (add topic)
-                for val in comments:
-                    if val["vid_id"] in processed_vids:
-                        cursor.execute(
-                            update_topic_sql,
-                            ([topic], val["id"])
+                    processed_values = [
+                        (
+                            val["vid_id"],
+                            val["id"],
+                        )
+                        for val in comments
+                        if (
+                            val["vid_id"] in processed_vids
+                            or val["vid_id"] in not_processed_vids
                         )
+                    ]
+                    copy_merge(cursor, "airflow.processed_vidIds",
+                               ["vid_id", "cmt_id"],
+                               processed_values, key_columns=["vid_id", "cmt_id"])
+                    loaded_vids.update(vid for vid, _cid in processed_values)
 
-                processed_values = [
-                    (
-                        val["vid_id"],
-                        val["id"],
-                    )
-                    for val in comments
-                    if (
-                        val["vid_id"] in processed_vids
-                        or val["vid_id"] in not_processed_vids
-                    )
-                ]
-                cursor.executemany(insert_processed_vidIds_sql, processed_values)
+                    # newest comment per video -> watermark for the next incremental run
+                    # (not for partial fetches, the comments between them and the old watermark are still missing)
+                    newest = {}
+                    for val in comments:
+                        if val["vid_id"] in partial_vids:
+                            continue
+                        cur = newest.get(val["vid_id"])
+                        if cur is None or val["p_timestamp"] > cur[1]:
+                            newest[val["vid_id"]] = (val["vid_id"], val["p_timestamp"], val["id"])
+                    execute_values(cursor, upsert_comment_watermarks_sql, list(newest.values()))
+
+                    # processed videos that got new comments also need embedding
+                    delta_vids.update(val["vid_id"] for val in comments if val["vid_id"] in processed_vids)
 
-        redis.delete(f"processed:{dag_id}")
-        redis.delete(f"not_processed:{dag_id}")
+        # keep the bloom filter warm so the next extract skips the DB for new videos
+        # (after a redis flush this leaves an unseeded key, the next extract reseeds it from the DB)
+        try:
+            processed_bloom(redis).add_many(loaded_vids)
+        except Exception as e:
+            print(f"[Bloom] failed to update filter: {e}")
+
+        if staged:
+            from services.chunk_store import remove_staging
+            remove_staging(ctx["dag_run"].run_id)
+
+        clear_run_state(redis, dag_id, run_id, ["processed", "not_processed", "partial"])
+        print(f"[PSQL] pool stats: {pool_stats()}")
         # serialize to json 
         not_processed_vids = [
             v.decode("utf-8") if isinstance(v, (bytes, bytearray)) else v
-            for v in not_processed_vids
+            for v in set(not_processed_vids) | delta_vids
         ]
         return {"topic": topic, "source_dag_id": dag_id, "vid_ids": not_processed_vids}
 
@@ -225,6 +384,10 @@ def start_genz_dag():
     payload >> trigger
 
 # --------------------- Comments Fetching Dag ----------------------------------
+# sharded inference: default shard count and the airflow pool that limits concurrent shards
+EMBED_SHARDS = int(os.getenv("EMBED_SHARDS", "1"))
+BERT_POOL = os.getenv("BERT_POOL", "bert_cpu")
+
 @dag(
     dag_id="embed_dag",
     start_date=datetime(2025, 1, 1),
@@ -244,13 +407,82 @@ def embed_dag():
         print("dag_run.conf:", conf)
         print("vid_ids:", conf.get("vid_ids"))
 
+        # schema bootstrap in its own short transaction: the embedding transactions below (and the
+        # mapped shards) only read/write embed_comments, so they never queue on each other's DDL locks
+        from services.embed_cache import ensure_schema
+        with psql_cursor() as cursor:
+            ensure_schema(cursor)
+
+        # "incremental" (default): only this run's videos, "full": re-embed the whole topic in chunks
+        if conf.get("embed_mode", "incremental") == "full":
+            with psql_cursor() as cursor:
+                run_embed.rebuild_embeddings(cursor, topic, chunk_size=conf.get("chunk_size", 2000))
+            return []
+
         if not vid_ids:
-            return
-        
+            return []
+
+        # tree size (above the builder's ann_threshold, 2000 nodes, parents come from an HNSW index)
+        # and mined candidate words, at least as many as the tree can hold
+        max_nodes = int(conf.get("max_nodes", 20))
+        top_k = max(int(conf.get("candidates", 200)), max_nodes)
+
+        # shards > 1 -> inference is spread over mapped embed_shard tasks, otherwise it runs here
+        n_shards = int(conf.get("shards", EMBED_SHARDS))
+        if n_shards <= 1:
+            # opens its own short transactions, none of them spans the inference
+            run_embed.create_embeddings(vid_ids, topic, max_nodes=max_nodes, top_k=top_k)
+            return []
+
         with psql_cursor() as cursor:
-            create_embeddings(vid_ids, cursor, topic)
-    
-    bert_embed()
+            prep = run_embed.prepare_embeddings(vid_ids, cursor, topic, top_k=top_k, max_nodes=max_nodes)
+        if not prep:
+            return []
+
+        ids = prep["ids"]
+        n_shards = min(n_shards, len(ids))
+        # pin threads so co-located shards don't oversubscribe the cores
+        threads = int(conf.get("threads_per_shard") or max(1, (os.cpu_count() or 1) // n_shards))
+        size = -(-len(ids) // n_shards)
+        return [
+            {
+                "index": i,
+                "ids": ids[i * size:(i + 1) * size],
+                "target_words": prep["target_words"],
+                "tree_words": prep["tree_words"],
+                "threads": threads,
+                "topic": topic,
+                "max_nodes": max_nodes,
+            }
+            for i in range(n_shards)
+        ]
+
+    # BERT_POOL caps how many CPU heavy shards run at the same time
+    @task(pool=BERT_POOL, pool_slots=1)
+    def embed_shard(shard):
+        threads = str(shard["threads"])
+        os.environ["OMP_NUM_THREADS"] = threads
+        os.environ["ONNX_THREADS"] = threads
+        import torch
+        torch.set_num_threads(shard["threads"])
+
+        from services.chunk_store import staging_dir
+        out_path = os.path.join(staging_dir(get_current_context()["dag_run"].run_id), f"embed_shard_{shard['index']:03d}.npz")
+        with psql_cursor() as cursor:
+            return run_embed.embed_shard(cursor, shard["ids"], shard["target_words"], out_path,
+                                         tree_words=shard["tree_words"])
+
+    @task
+    def merge_shards(shard_paths, shards):
+        from services.chunk_store import remove_staging
+        with psql_cursor() as cursor:
+            run_embed.finish_embeddings(cursor, shards[0]["topic"], shards[0]["target_words"], list(shard_paths),
+                                        max_nodes=shards[0]["max_nodes"], tree_words=shards[0]["tree_words"])
+        remove_staging(get_current_context()["dag_run"].run_id)
+
+    shards = bert_embed()
+    shard_paths = embed_shard.expand(shard=shards)
+    merge_shards(shard_paths, shards)
 
 # call the dag
 start_genz_dag()
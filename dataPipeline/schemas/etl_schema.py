@@ -34,6 +34,16 @@ CREATE TABLE IF NOT EXISTS airflow.processed_vidIds (
 );
 """
 
+# newest comment already ingested per video (incremental fetching)
+execute_comment_watermarks_sql = """
+CREATE TABLE IF NOT EXISTS airflow.comment_watermarks (
+    vid_id TEXT PRIMARY KEY,
+    last_published_at TIMESTAMP NOT NULL,
+    last_cmt_id TEXT NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
 execute_comment_lang_sql = """
 CREATE TABLE IF NOT EXISTS airflow.comment_lang(
     comment_id TEXT PRIMARY KEY,
@@ -64,10 +74,37 @@ CREATE TABLE IF NOT EXISTS airflow.embed_comments (
   comment_id TEXT PRIMARY KEY
     REFERENCES airflow.cleaned_comments(comment_id) ON DELETE CASCADE,
   embedding vector(768),                 
-  embedded_at TIMESTAMPTZ DEFAULT now()
+  embedded_at TIMESTAMPTZ DEFAULT now(),
+  text_hash TEXT,
+  model_id TEXT,
+  sentiment TEXT,
+  sentiment_model_id TEXT
 );
 """
 
+# content-addressed cache columns: same cleaned text + same model -> same embedding,
+# and the same sentiment while sentiment_model_id (weights of the classifier) matches too.
+# Migrates tables created before them; ALTER TABLE / CREATE INDEX lock the table even when
+# there is nothing to do, so they only run when the catalog says something is missing.
+execute_embed_cache_cols_sql = """
+DO $$
+BEGIN
+  IF (SELECT count(*) FROM information_schema.columns
+      WHERE table_schema = 'airflow' AND table_name = 'embed_comments'
+        AND column_name IN ('text_hash', 'model_id', 'sentiment', 'sentiment_model_id')) < 4 THEN
+    ALTER TABLE airflow.embed_comments
+      ADD COLUMN IF NOT EXISTS text_hash TEXT,
+      ADD COLUMN IF NOT EXISTS model_id TEXT,
+      ADD COLUMN IF NOT EXISTS sentiment TEXT,
+      ADD COLUMN IF NOT EXISTS sentiment_model_id TEXT;
+  END IF;
+  IF to_regclass('airflow.embed_comments_cache_idx') IS NULL THEN
+    CREATE INDEX IF NOT EXISTS embed_comments_cache_idx
+      ON airflow.embed_comments (model_id, text_hash);
+  END IF;
+END $$;
+"""
+
 execute_words_vec_sql = """
 CREATE TABLE IF NOT EXISTS airflow.words_vec (
   topic     TEXT NOT NULL,
@@ -86,6 +123,22 @@ CREATE TABLE IF NOT EXISTS airflow.words_occur (
 );
 """
 
+# per-topic term statistics for candidate vocabulary mining (updated incrementally)
+execute_topic_terms_sql = """
+CREATE TABLE IF NOT EXISTS airflow.topic_term_stats (
+  topic TEXT NOT NULL,
+  term  TEXT NOT NULL,
+  df    BIGINT NOT NULL DEFAULT 0,   -- number of comments containing the term
+  tf    BIGINT NOT NULL DEFAULT 0,   -- total occurrences
+  PRIMARY KEY (topic, term)
+);
+CREATE TABLE IF NOT EXISTS airflow.topic_term_docs (
+  topic      TEXT NOT NULL,
+  comment_id TEXT NOT NULL,
+  PRIMARY KEY (topic, comment_id)
+);
+"""
+
 execute_trees_sql = """
 CREATE TABLE IF NOT EXISTS airflow.trees (
     id         UUID PRIMARY KEY DEFAULT gen_random_uuid(),
@@ -113,31 +166,22 @@ CREATE TABLE IF NOT EXISTS airflow.tree_nodes (
 );
 """
 
-insert_comments_sql = """
-INSERT INTO comments (id, comment, author, p_timestamp, t_timestamp)
-VALUES (%s, %s, %s, %s, %s)
-ON CONFLICT (id) DO NOTHING;
-"""
-
-insert_topic_sql = """
-INSERT INTO topic_collector (id, topic, collector, dag_id)
-VALUES (%s, %s, %s, %s)
-ON CONFLICT (id) DO NOTHING;
-"""
-
-insert_processed_vidIds_sql = """
-INSERT INTO processed_vidIds (vid_id, cmt_id)
-VALUES (%s, %s)
-ON CONFLICT (vid_id, cmt_id) DO NOTHING;
+upsert_comment_watermarks_sql = """
+INSERT INTO airflow.comment_watermarks (vid_id, last_published_at, last_cmt_id)
+VALUES %s
+ON CONFLICT (vid_id) DO UPDATE
+SET last_published_at = EXCLUDED.last_published_at,
+    last_cmt_id = EXCLUDED.last_cmt_id,
+    updated_at = CURRENT_TIMESTAMP
+WHERE EXCLUDED.last_published_at >= comment_watermarks.last_published_at;
 """
 
-update_topic_sql = """
-UPDATE topic_collector
-SET topic = ARRAY(
-    SELECT DISTINCT unnest(topic || %s)
+# copy_merge conflict clause for topic_collector: a comment already tagged by another
+# (possibly concurrent) run keeps its topics and gains this run's
+merge_topic_on_conflict_sql = """DO UPDATE SET topic = ARRAY(
+    SELECT DISTINCT unnest(topic_collector.topic || EXCLUDED.topic)
 )
-WHERE id = %s;
-"""
+WHERE NOT (topic_collector.topic @> EXCLUDED.topic)"""
 
 insert_cleaned_comments = """
 INSERT INTO cleaned_comments(comment_id, cleaned_text, sentiment)
@@ -146,31 +190,3 @@ ON CONFLICT (comment_id) DO UPDATE
 SET cleaned_text = EXCLUDED.cleaned_text,
     sentiment = EXCLUDED.sentiment;
 """
-
-insert_embed_comments = """
-INSERT INTO embed_comments (comment_id, embedding)
-VALUES (%s, %s)
-ON CONFLICT (comment_id) DO UPDATE
-SET embedding = EXCLUDED.embedding,
-    embedded_at = now()
-"""
-
-insert_comment_lang = """
-    INSERT INTO airflow.comment_lang (comment_id, language)
-    VALUES %s
-    ON CONFLICT (comment_id) DO UPDATE SET language = EXCLUDED.language
-"""
-
-insert_words_occur = """
-INSERT INTO airflow.words_occur (topic, word, word_cmt_ids)
-VALUES (%s, %s, %s)
-ON CONFLICT (topic, word) DO UPDATE
-SET word_cmt_ids = EXCLUDED.word_cmt_ids;
-"""
-
-insert_words_vec = """
-INSERT INTO airflow.words_vec (topic, word, word_vec)
-VALUES (%s, %s, %s)
-ON CONFLICT (topic, word)
-DO UPDATE SET word_vec = EXCLUDED.word_vec;
-"""
\ No newline at end of file
@@ -1,66 +1,299 @@
 import json
+import hashlib
+import uuid
 import torch
 import numpy as np
 import os  
-from transformers import BertTokenizer, BertModel
-from sklearn.metrics.pairwise import cosine_similarity
+from transformers import BertTokenizerFast, BertModel, BertConfig
+from psycopg2.extras import execute_values
+from services.embed_backends import get_backend
+
+# context-free vectors of target words that never occur in the comments, per model
+STATIC_VEC_DIR = "/opt/airflow/data/static_word_vecs"
+
+# rough activation cost of one token during a BertModel forward pass (bytes per hidden unit)
+# used to turn a memory budget into a batch size
+_BYTES_PER_TOKEN_UNIT = 4 * 24
 
 class TaxonomyAndTreeBuilder:
-    def __init__(self, threshold, pro_cmts, target_words):
+    def __init__(self, threshold, pro_cmts, target_words, batch_size=None, memory_budget_mb=1024):
         # --- OFFLINE FIX START ---
         # Look for the baked-in folder from the Dockerfile
         model_path = "/bert_model" if os.path.exists("/bert_model") else 'bert-base-uncased'
         is_offline = os.path.exists("/bert_model")
 
-        self.tokenizer = BertTokenizer.from_pretrained(model_path, local_files_only=is_offline)
-        self.model = BertModel.from_pretrained(model_path, local_files_only=is_offline)
+        self.tokenizer = BertTokenizerFast.from_pretrained(model_path, local_files_only=is_offline)
+        self.config = BertConfig.from_pretrained(model_path, local_files_only=is_offline)
         # --- OFFLINE FIX END ---
+        self.model_path = model_path
+        self.is_offline = is_offline
+        self._model = None
         
         self.pro_cmts = pro_cmts
         self.target_words = target_words
         self.threshold = threshold
+        # inference batching: fixed batch_size, or derived from memory_budget_mb per batch
+        self.batch_size = batch_size
+        self.memory_budget_mb = memory_budget_mb
+        # {row: comment vector} already known (embedding cache), these rows skip inference
+        # unless their token vectors are needed for target words
+        self.cached_vecs = {}
+        # create_tree switches to an approximate (HNSW) parent search above this many nodes
+        self.ann_threshold = 2000
+        # optional sentiment stage fed from the same inference batches:
+        # classifier(token_states (batch, steps, 768)) -> labels, results land in self.sentiments {row: label}
+        self.sentiment_classifier = None
+        self.sentiment_steps = 10
+        self.cached_sentiments = {}
+        self.sentiments = {}
+        # target words that can end up in the tree (see most_frequent), only these get token
+        # vectors, so comments without them can come straight from the embedding cache; None = all
+        self.tree_words = None
+        # resident embed service if running, else torch (default) / onnx runtime picked by EMBED_BACKEND
+        self.backend = get_backend(self._load_model, self.checkpoint_id)
+
+    def _load_model(self):
+        # weights are only loaded when inference runs in this process
+        if self._model is None:
+            self._model = BertModel.from_pretrained(self.model_path, local_files_only=self.is_offline)
+        return self._model
+
+    @property
+    def model(self):
+        return self._load_model()
+
+    @property
+    def model_id(self):
+        """Checkpoint + backend, onnx/int8 vectors differ slightly from eager torch"""
+        return f"{self.checkpoint_id}-{self.backend.name}"
+
+    @property
+    def checkpoint_id(self):
+        """Identity of the loaded model: path + config + weight files, changes whenever the checkpoint does"""
+        h = hashlib.sha1(self.model_path.encode("utf-8"))
+        h.update(self.config.to_json_string().encode("utf-8"))
+        if os.path.isdir(self.model_path):
+            for name in sorted(os.listdir(self.model_path)):
+                st = os.stat(os.path.join(self.model_path, name))
+                h.update(f"{name}:{st.st_size}:{int(st.st_mtime)}".encode("utf-8"))
+        return f"{os.path.basename(self.model_path.rstrip('/'))}-{h.hexdigest()[:16]}"
     
-    def calculate_dynamic_abstractness(self, word_occur, cmt_vecs):
+    @staticmethod
+    def score_abstractness(word_vecs, cmt_vecs, chunk_size=8192):
         """
-            word_occurrences: list of vectors for a specific word from different cmts
-            cmt_vecs: the summarized vector for each comment
+        Abstractness of every word at once: 1 - variance of its cosine similarity to all comments.
+            word_vecs: (n_words, 768) mean vector per word
+            cmt_vecs: (n_cmts, 768) comment vectors
+        The words x comments cosine matrix is computed with one GEMM per chunk of comments,
+        keeping only running sums, so memory stays O(n_words * chunk_size).
+        Returns abs_scores (n_words,) = 1 - variance of each word's similarities.
         """
-        if not word_occur:
-            return 0.5, np.zeros(768)
-        
-        # average the vectors to get one 'global' word embedding for the tree
-        mean_word_vec = np.mean(word_occur, axis=0)
-        
-        # calculate similarities to ALL comments to see 'distributional breadth'
-        sims = cosine_similarity([mean_word_vec], cmt_vecs)[0]
-        
+        _normalize = TaxonomyAndTreeBuilder._normalize_rows
+        words = _normalize(word_vecs)
+        n_cmts = len(cmt_vecs)
+        if not len(words) or not n_cmts:
+            return np.full(len(words), 0.5)
+
+        sum_s = np.zeros(len(words), dtype=np.float64)
+        sum_sq = np.zeros(len(words), dtype=np.float64)
+        for start in range(0, n_cmts, chunk_size):
+            sims = words @ _normalize(cmt_vecs[start:start + chunk_size]).T   # (n_words, chunk)
+            sum_s += sims.sum(axis=1)
+            sum_sq += np.square(sims, dtype=np.float64).sum(axis=1)
+
+        mean = sum_s / n_cmts
+        var = np.maximum(sum_sq / n_cmts - mean ** 2, 0.0)
         # abstractness = 1 - Variance (Lower variance = more abstract/consistent)
-        abs_score = 1 - np.var(sims)
-        return abs_score, mean_word_vec
+        return 1 - var
+
+    def _static_word_vecs(self, words):
+        """
+        Context-free vectors ([CLS] word [SEP] mean) for words that don't occur in any comment.
+        They never change for a given model, so they are cached on disk per model_id and
+        only the missing ones are computed, all in one forward pass.
+        """
+        if not words:
+            return {}
+        path = os.path.join(STATIC_VEC_DIR, f"{self.model_id}.npz")
+        cache = {}
+        if os.path.exists(path):
+            try:
+                with np.load(path) as data:
+                    cache = {w: data[w] for w in data.files}
+            except Exception as e:
+                print(f"[BERT] static word cache unreadable, rebuilding: {e}")
+
+        missing = [w for w in words if w not in cache]
+        if missing:
+            inputs = self.tokenizer(missing, return_tensors="pt", padding=True)
+            last_hidden = self.backend.last_hidden_state(inputs)
+            mask = inputs["attention_mask"].unsqueeze(-1)
+            vecs = ((last_hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)).numpy()
+            cache.update(zip(missing, vecs))
+
+            os.makedirs(STATIC_VEC_DIR, exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.tmp.npz"
+            np.savez(tmp, **cache)
+            os.replace(tmp, path)   # concurrent runs never read a half-written file
+        print(f"[BERT] static word vectors: {len(words) - len(missing)} cached, {len(missing)} computed")
+        return {w: cache[w] for w in words}
 
     def _tokenizer(self):
-        # Joined as values if pro_cmts is a dict
-        cmts = [" ".join(words) for words in self.pro_cmts.values()]
-        inputs = self.tokenizer(cmts, return_tensors="pt", padding=True, truncation=True) # reutrn pytorch tensors
-        return inputs
+        # pre-split words so the fast tokenizer can map sub-tokens back to them (word_ids)
+        cmts = [list(words) for words in self.pro_cmts.values()]
+        # no padding here, every batch is padded to its own longest comment
+        return self.tokenizer(cmts, is_split_into_words=True, truncation=True)
+
+    @staticmethod
+    def most_frequent(pro_cmts, target_words, k):
+        """
+        The k target words found in the most comments, ties in target_words order.
+        create_tree keeps the top max_nodes words by the same count (imp_score), so with
+        k = max_nodes these are the only words that can become tree nodes.
+        """
+        counts = dict.fromkeys(target_words, 0)
+        for cmt in pro_cmts.values():
+            for word in counts.keys() & set(cmt):
+                counts[word] += 1
+        return sorted(counts, key=counts.get, reverse=True)[:k]
+
+    def _vector_words(self):
+        return self.target_words if self.tree_words is None else self.tree_words
+
+    def _word_index(self, words=None):
+        """
+        Inverted index in one pass over the comments: {word: [(row, word_idx)]}
+        with the first position of every target word (or of words) in each comment.
+        """
+        targets = set(self.target_words if words is None else words)
+        index = {}
+        for row, cmt in enumerate(self.pro_cmts.values()):
+            seen = set()
+            for word_idx, word in enumerate(cmt):
+                if word in targets and word not in seen:
+                    seen.add(word)
+                    index.setdefault(word, []).append((row, word_idx))
+        return index
+
+    def _token_spans(self, enc, index):
+        """{row: [(word, tok_start, tok_end)]} sub-token span of every indexed word (WordPiece aware)"""
+        spans = {}
+        rows_needed = {row for occ in index.values() for row, _ in occ}
+        # word idx -> (first token, last token + 1) per comment
+        word_tokens = {}
+        for row in rows_needed:
+            bounds = {}
+            for tok, w in enumerate(enc.word_ids(row)):
+                if w is None:
+                    continue
+                start, _end = bounds.get(w, (tok, tok))
+                bounds[w] = (start, tok + 1)
+            word_tokens[row] = bounds
+        for word, occ in index.items():
+            for row, word_idx in occ:
+                # words cut off by truncation have no tokens
+                if word_idx in word_tokens[row]:
+                    start, end = word_tokens[row][word_idx]
+                    spans.setdefault(row, []).append((word, start, end))
+        return spans
+
+    def _batches(self, order, seq_lens):
+        """Groups row indices (sorted by length) into batches that fit the batch size / memory budget"""
+        hidden = self.config.hidden_size
+        budget = self.memory_budget_mb * 1024 * 1024
+        batch = []
+        for i in order:
+            longest = seq_lens[i]   # ascending order -> current row is the longest so far
+            too_big = (len(batch) + 1) * longest * hidden * _BYTES_PER_TOKEN_UNIT > budget
+            too_many = self.batch_size is not None and len(batch) >= self.batch_size
+            if batch and (too_big or too_many):
+                yield batch
+                batch = []
+            batch.append(i)
+        if batch:
+            yield batch
 
     def run_bert(self):
-        inputs = self._tokenizer()
-        outputs = self.model(**inputs)
+        """
+        Length-bucketed, batched inference without autograd.
+        Returns:
+            comment_vecs: (n_cmts, 768) mean pooled comment vectors
+            target_vecs: {word: [(row, token_vec)]} only the token vectors of target words
+        With sentiment_classifier set, self.sentiments gets a label for every row.
+        """
+        enc = self._tokenizer()
+        seq_lens = [len(ids) for ids in enc["input_ids"]]
+        n = len(seq_lens)
+        comment_vecs = np.zeros((n, self.config.hidden_size), dtype=np.float32)
+        positions = self._token_spans(enc, self._word_index(self._vector_words()))
+        target_vecs = {}
+        for row, vec in self.cached_vecs.items():
+            comment_vecs[row] = vec
+        classify = self.sentiment_classifier
+        self.sentiments = dict(self.cached_sentiments) if classify is not None else {}
 
-        # get last hidden state
-        # vector for each word (cmts separate)
-        last_hidden = outputs.last_hidden_state      # (batch, seq_len, 768)
-        mask = inputs["attention_mask"].unsqueeze(-1)    # (batch, seq_len, 1)
+        # sort by token length so padding inside a batch stays small
+        todo = [
+            i for i in range(n)
+            if i not in self.cached_vecs or i in positions or (classify is not None and i not in self.sentiments)
+        ]
+        order = sorted(todo, key=lambda i: seq_lens[i])
+        with torch.inference_mode():
+            for batch in self._batches(order, seq_lens):
+                inputs = self.tokenizer.pad(
+                    [{k: enc[k][i] for k in enc.keys()} for i in batch],
+                    return_tensors="pt",
+                )
+                last_hidden = self.backend.last_hidden_state(inputs)   # (batch, seq_len, 768)
+                mask = inputs["attention_mask"].unsqueeze(-1)           # (batch, seq_len, 1)
 
-        # mean pooling (ignore PAD tokens)
-        summed = (last_hidden * mask).sum(dim=1)   # (batch, 768)
-        
-        # mask.sum(dim=1) is for knowing how many real words are present as 1's for real word and 0's for padding
-        # .clamp is there to avoid division by zero. It ensures the divisor is at least a tiny value but not zero
-        counts = mask.sum(dim=1).clamp(min=1e-9)         # (batch, 1)
-        comment_vecs = summed / counts                   # (batch, 768)
-        return comment_vecs, last_hidden
+                # mean pooling (ignore PAD tokens)
+                summed = (last_hidden * mask).sum(dim=1)
+                # .clamp is there to avoid division by zero
+                counts = mask.sum(dim=1).clamp(min=1e-9)
+                pooled = (summed / counts).numpy()
+                for j, row in enumerate(batch):
+                    if row not in self.cached_vecs:
+                        comment_vecs[row] = pooled[j]
+
+                if classify is not None:
+                    self._classify_batch(classify, batch, last_hidden, seq_lens)
+
+                # keep only the token vectors we need, drop the rest of last_hidden:
+                # gather every sub-token of every target word at once, then mean per word span
+                b_idx, t_idx, seg_idx, segs = [], [], [], []
+                for j, row in enumerate(batch):
+                    for word, start, end in positions.get(row, []):
+                        for t in range(start, end):
+                            b_idx.append(j)
+                            t_idx.append(t)
+                            seg_idx.append(len(segs))
+                        segs.append((word, row))
+                if segs:
+                    gathered = last_hidden[torch.tensor(b_idx), torch.tensor(t_idx)]      # (n_tokens, 768)
+                    seg = torch.tensor(seg_idx)
+                    sums = torch.zeros(len(segs), gathered.shape[1]).index_add_(0, seg, gathered)
+                    span_vecs = (sums / torch.bincount(seg, minlength=len(segs)).unsqueeze(1)).numpy()
+                    for (word, row), vec in zip(segs, span_vecs):
+                        target_vecs.setdefault(word, []).append((row, vec))
+
+        return comment_vecs, target_vecs
+
+    def _classify_batch(self, classify, batch, last_hidden, seq_lens):
+        """Sentiment for the batch rows without a label, from their first sentiment_steps token states"""
+        need = [j for j, row in enumerate(batch) if row not in self.sentiments]
+        if not need:
+            return
+        steps = self.sentiment_steps
+        seqs = last_hidden[need, 1:1 + steps]                       # skip [CLS]
+        # zero [SEP] and padding, then pad short batches up to steps
+        lens = torch.tensor([seq_lens[batch[j]] - 2 for j in need])
+        keep = torch.arange(seqs.shape[1]).unsqueeze(0) < lens.unsqueeze(1)
+        seqs = seqs * keep.unsqueeze(-1)
+        if seqs.shape[1] < steps:
+            seqs = torch.nn.functional.pad(seqs, (0, 0, 0, steps - seqs.shape[1]))
+        for j, label in zip(need, classify(seqs)):
+            self.sentiments[batch[j]] = label
 
     def create_tree(self, word_metadata, word_vectors, imp_score, max_nodes=25):
         """
@@ -70,7 +303,7 @@ class TaxonomyAndTreeBuilder:
         # Adapt pruning floor based on sample size
         floor = 0.01 if len(self.pro_cmts) > 10 else 0.0
         sorted_active = sorted(imp_score.items(), key=lambda x: x[1], reverse=True)[:max_nodes]
-        active_words = [w[0] for w in sorted_active if w[1] >= floor]  
+        active_words = [w[0] for w in sorted_active if w[1] >= floor and w[0] in word_vectors]
         
         # sort words by abstractness (Descending: Highest score first)
         active_sorted = sorted(active_words, key=lambda w: word_metadata[w]["abs_score"], reverse=True)
@@ -81,32 +314,89 @@ class TaxonomyAndTreeBuilder:
         # Internal branching sensitivity cap
         branch_threshold = min(self.threshold, 0.28)
 
+        if not active_sorted:
+            return tree, roots
+
+        # compare every word against all words more abstract than it (potential parents)
+        vecs = self._normalize_rows(np.stack([word_vectors[w] for w in active_sorted]))
+        if len(active_sorted) > self.ann_threshold:
+            parents, sims = self._best_parents_ann(vecs)
+        else:
+            parents, sims = self._best_parents(vecs)
+
         for i, word in enumerate(active_sorted):
             # the most abstract word is automatically a root
             if i == 0:
                 roots.append(word); continue
 
-            best_match = None
-            max_sim = -1
-            child_vec = word_vectors[word].reshape(1, -1)
-
-            # compare current word against all words more abstract than it (potential parents)
-            for j in range(i):
-                potential_parent = active_sorted[j]
-                parent_vec = word_vectors[potential_parent].reshape(1, -1)
-                sim = cosine_similarity(parent_vec, child_vec)[0][0]
-                if sim > max_sim:
-                    max_sim = sim
-                    best_match = potential_parent
-
             # assign to parent if it passes threshold, otherwise it's a new root
-            if best_match and max_sim >= branch_threshold:
-                tree[best_match].append(word)
+            if sims[i] >= branch_threshold:
+                tree[active_sorted[parents[i]]].append(word)
             else:
                 roots.append(word)
 
         return tree, roots
 
+    @staticmethod
+    def _normalize_rows(m):
+        m = np.asarray(m, dtype=np.float32)
+        norms = np.linalg.norm(m, axis=1, keepdims=True)
+        return np.divide(m, norms, out=np.zeros_like(m), where=norms > 0)
+
+    @staticmethod
+    def _best_parents(vecs, block=1024):
+        """
+        Exact parent search: for row i, argmax of cosine over rows j < i.
+        Uses the similarity matrix block by block with the upper triangle masked out.
+        Returns (parent index, similarity) arrays, row 0 has no parent (-inf).
+        """
+        n = len(vecs)
+        parents = np.full(n, -1)
+        sims = np.full(n, -np.inf)
+        for start in range(1, n, block):
+            stop = min(start + block, n)
+            sim = vecs[start:stop] @ vecs[:stop].T                     # (block, stop)
+            rows = np.arange(start, stop)[:, None]
+            sim[np.arange(stop)[None, :] >= rows] = -np.inf            # only more abstract words
+            best = sim.argmax(axis=1)
+            parents[start:stop] = best
+            sims[start:stop] = sim[np.arange(stop - start), best]
+        return parents, sims
+
+    def _best_parents_ann(self, vecs, k=32):
+        """
+        Approximate parent search for large vocabularies with an HNSW index (hnswlib).
+        Nearest neighbours that are less abstract are ignored; rows without a valid
+        neighbour in the top-k fall back to the exact search for that row.
+        """
+        try:
+            import hnswlib
+        except ImportError:
+            print("[Tree] hnswlib not installed, using exact parent search")
+            return self._best_parents(vecs)
+
+        n, dim = vecs.shape
+        index = hnswlib.Index(space="ip", dim=dim)   # vectors are normalized -> ip == cosine
+        index.init_index(max_elements=n, ef_construction=200, M=16)
+        index.add_items(vecs, np.arange(n))
+        k = min(k, n)
+        index.set_ef(max(64, k))
+        labels, dists = index.knn_query(vecs, k=k)
+        nn_sims = 1 - dists
+
+        parents = np.full(n, -1)
+        sims = np.full(n, -np.inf)
+        for i in range(1, n):
+            valid = labels[i] < i
+            if valid.any():
+                j = np.argmax(np.where(valid, nn_sims[i], -np.inf))
+                parents[i], sims[i] = labels[i][j], nn_sims[i][j]
+            else:
+                row = vecs[:i] @ vecs[i]
+                parents[i] = row.argmax()
+                sims[i] = row[parents[i]]
+        return parents, sims
+
     def _draw_tree(self, tree, nodes, indent=0):
         for node in nodes:
             # create the visual prefix (the "branch" look)
@@ -127,84 +417,121 @@ class TaxonomyAndTreeBuilder:
                 parent[c] = p
         return parent
 
-    def save_tree(self, tree, roots, cursor, topic, imp_score, occur):
+    @staticmethod
+    def _majority_sentiments(cursor, occur, words):
         """
-        Your restored logic: Two-pass insertion with UUID handshake.
-        Added sentiment mapping to fill lstm_val.
+        Majority sentiment per word with one grouped query over (word, comment_id) pairs.
+        Returns {word: lstm_val}, 0.5 when a word has no labelled comments.
         """
-        # --- NEW: Sentiment Mapping ---
         mapping = {"Positive": 1.0, "Neutral": 0.5, "Negative": 0.0}
-        word_sent_vals = {}
-        for word, cids in occur.items():
-            cursor.execute("SELECT sentiment FROM airflow.cleaned_comments WHERE comment_id = ANY(%s)", (list(cids),))
-            sents = [r[0] for r in cursor.fetchall() if r[0] not in [None, 'Pending']]
-            word_sent_vals[word] = mapping.get(max(set(sents), key=sents.count), 0.5) if sents else 0.5
+        pairs = [(word, cid) for word in words for cid in occur.get(word, [])]
+        if not pairs:
+            return {}
+        cursor.execute(
+            """
+            SELECT w.word, cc.sentiment, COUNT(*)
+            FROM unnest(%s::text[], %s::text[]) AS w(word, cid)
+            JOIN airflow.cleaned_comments cc ON cc.comment_id = w.cid
+            WHERE cc.sentiment IS NOT NULL AND cc.sentiment <> 'Pending'
+            GROUP BY w.word, cc.sentiment;
+            """,
+            ([w for w, _ in pairs], [c for _, c in pairs]),
+        )
+        best = {}
+        for word, sent, count in cursor.fetchall():
+            if word not in best or (count, sent) > best[word]:
+                best[word] = (count, sent)
+        return {word: mapping.get(sent, 0.5) for word, (_count, sent) in best.items()}
 
+    def save_tree(self, tree, roots, cursor, topic, imp_score, occur):
+        """
+        Bulk persistence: node UUIDs are generated here so every parent id is known
+        up front, then the tree row and all nodes are written with two statements.
+        lstm_val is the majority sentiment of the comments each word occurs in.
+        """
         parent_map = self._build_parent_map(tree, roots)
+        word_sent_vals = self._majority_sentiments(cursor, occur, parent_map.keys())
 
-        # create tree row
-        cursor.execute("INSERT INTO airflow.trees (name) VALUES (%s) RETURNING id;", (topic,))
-        tree_id = cursor.fetchone()[0]
-
-        # 1st Pass: insert all nodes first (parent_id NULL for now)
-        word_to_id = {}
-        for word in parent_map.keys():
-            imp_val = imp_score.get(word, 0)
-            l_val = word_sent_vals.get(word, 0.5) # Fetched from LSTM map
-            cursor.execute(
-                """
-                INSERT INTO airflow.tree_nodes (tree_id, text, imp_val, lstm_val, parent_id)
-                VALUES (%s, %s, %s, %s, NULL)
-                RETURNING id;
-                """,
-                (tree_id, word, imp_val, l_val),
-            )
-            word_to_id[word] = cursor.fetchone()[0]
-
-        # 2nd Pass: update parent_id for non-roots
-        for child, parent in parent_map.items():
-            if parent is None:
-                continue
-            cursor.execute(
-                """
-                UPDATE airflow.tree_nodes
-                SET parent_id = %s
-                WHERE tree_id = %s AND id = %s;
-                """,
-                (word_to_id[parent], tree_id, word_to_id[child]),
+        tree_id = str(uuid.uuid4())
+        word_to_id = {word: str(uuid.uuid4()) for word in parent_map}
+
+        # parents before children (BFS from the roots)
+        ordered, queue = [], list(roots)
+        while queue:
+            word = queue.pop(0)
+            ordered.append(word)
+            queue.extend(tree.get(word, []))
+
+        node_rows = [
+            (
+                word_to_id[word],
+                tree_id,
+                word_to_id[parent_map[word]] if parent_map[word] is not None else None,
+                word,
+                imp_score.get(word, 0),
+                word_sent_vals.get(word, 0.5), # Fetched from LSTM map
             )
+            for word in ordered
+        ]
 
-    def build_tree(self):
-        # tokenize and get comments embeddings
-        cmts_vec_t, words_vec_t = self.run_bert()
-        cmts_vec = cmts_vec_t.detach().numpy()
-        words_vec = words_vec_t.detach().numpy()
-
-        # map the words to its abs score
-        word_metadata, word_vectors, occur, imp_score = {}, {}, {}, {}
-        n_cmts = len(self.pro_cmts)
-
-        # for every unq word, find its context and score
-        for word in self.target_words:
-            temp_occur = []
-            for i, (ids, cmt) in enumerate(self.pro_cmts.items()):
-                if word in cmt:
-                    idx = cmt.index(word)
-                    if word not in occur: occur[word] = []
-                    occur[word].append(ids)
-                    # BERT adds a [CLS] token at index 0, so words at idx + 1
-                    temp_occur.append(words_vec[i, idx+1, :])
-            if not temp_occur:
-                # get a standalone vector if word not in comments
-                inputs = self.tokenizer(word, return_tensors="pt")
-                output = self.model(**inputs)
-                mean_vec = output.last_hidden_state.mean(dim=1).squeeze().detach().numpy()
-                score = 0.5 # neutral abs for unseen words
-            else:
-                score, mean_vec = self.calculate_dynamic_abstractness(temp_occur, cmts_vec)
-            
-            word_metadata[word] = {"abs_score": score}
+        cursor.execute("INSERT INTO airflow.trees (id, name) VALUES (%s::uuid, %s);", (tree_id, topic))
+        execute_values(
+            cursor,
+            """
+            INSERT INTO airflow.tree_nodes (id, tree_id, parent_id, text, imp_val, lstm_val)
+            VALUES %s;
+            """,
+            node_rows,
+            template="(%s::uuid, %s::uuid, %s::uuid, %s, %s, %s)",
+            page_size=max(len(node_rows), 1),
+        )
+        return tree_id
+
+    def word_occurrences(self):
+        """{word: [comment_id]} from the inverted index (one pass, not words x comments)"""
+        cids = list(self.pro_cmts.keys())
+        return {word: [cids[row] for row, _ in occ] for word, occ in self._word_index().items()}
+
+    def score_words(self, cmts_vec, occur, mean_vecs):
+        """
+        cmts_vec: (n_cmts, 768) comment vectors, occur: {word: [comment_id]}
+        mean_vecs: {word: mean token vector} for the words found in the comments
+        Returns word_metadata, word_vectors for the tree words (every target word if tree_words
+        is not set) and imp_score for every target word.
+        """
+        word_metadata, word_vectors = {}, {}
+        n_cmts = len(cmts_vec)
+        vector_words = dict.fromkeys(self._vector_words())
+
+        seen = [w for w in vector_words if w in mean_vecs]
+        stacked = np.stack([mean_vecs[w] for w in seen]) \
+            if seen else np.zeros((0, cmts_vec.shape[1]), dtype=np.float32)
+
+        # score the whole vocabulary at once
+        abs_scores = self.score_abstractness(stacked, cmts_vec)
+        counts = np.array([len(occur.get(w, [])) for w in self.target_words], dtype=np.float64)
+        imp_vals = counts / n_cmts if n_cmts > 0 else np.zeros(len(self.target_words))
+
+        for word, score, mean_vec in zip(seen, abs_scores, stacked):
+            word_metadata[word] = {"abs_score": float(score)}
             word_vectors[word] = mean_vec
-            imp_score[word] = len(occur.get(word, [])) / n_cmts if n_cmts > 0 else 0
-        
+
+        # get a standalone vector for words not in comments
+        unseen = [w for w in vector_words if w not in word_vectors]
+        for word, vec in self._static_word_vecs(unseen).items():
+            word_vectors[word] = vec
+            word_metadata[word] = {"abs_score": 0.5} # neutral abs for unseen words
+
+        imp_score = {word: float(val) for word, val in zip(self.target_words, imp_vals)}
+        return word_metadata, word_vectors, imp_score
+
+    def build_tree(self):
+        # tokenize and get comments embeddings (+ target word token vectors)
+        cmts_vec, target_vecs = self.run_bert()
+        occur = self.word_occurrences()
+
+        # average the occurrence vectors to get one 'global' embedding per word
+        mean_vecs = {w: np.mean([vec for _row, vec in occ], axis=0) for w, occ in target_vecs.items()}
+
+        word_metadata, word_vectors, imp_score = self.score_words(cmts_vec, occur, mean_vecs)
         return cmts_vec, occur, word_vectors, word_metadata, imp_score
\ No newline at end of file
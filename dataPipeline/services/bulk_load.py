@@ -0,0 +1,76 @@
+import io
+
+
+def pg_array(values):
+    """Postgres TEXT[] literal for COPY, e.g. ['a', 'b'] -> {"a","b"}"""
+    items = []
+    for v in values:
+        v = str(v).replace("\\", "\\\\").replace('"', '\\"')
+        items.append(f'"{v}"')
+    return "{" + ",".join(items) + "}"
+
+
+def pg_vector(values):
+    """pgvector literal for COPY, e.g. [0.1, 0.2] -> [0.1,0.2]"""
+    return "[" + ",".join(str(float(v)) for v in values) + "]"
+
+
+def _csv_field(value):
+    # unquoted empty field = NULL in postgres CSV, quoted "" = empty string
+    if value is None:
+        return ""
+    if isinstance(value, (int, float)):
+        return str(value)
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+def _csv_row(row):
+    """One COPY ... WITH (FORMAT csv) line: None -> NULL, '' stays '', strings always quoted"""
+    return ",".join(_csv_field(v) for v in row) + "\n"
+
+
+def copy_merge(cursor, table, columns, rows, key_columns, on_conflict="DO NOTHING", page_size=50000):
+    """
+    Bulk upsert: streams rows with COPY ... FROM STDIN into a temp staging table,
+    then merges them into `table` with one INSERT ... SELECT ... ON CONFLICT.
+    - rows: iterable of tuples in `columns` order (arrays/vectors pre-formatted with pg_array/pg_vector)
+    - key_columns: conflict target, also used to drop duplicate keys inside the batch
+    - on_conflict: "DO NOTHING" or "DO UPDATE SET ..."
+    Returns the number of rows copied.
+    """
+    staging = f"tmp_{table.split('.')[-1].lower()}"
+    cols = ", ".join(columns)
+    keys = ", ".join(key_columns)
+
+    # temp table lives until the transaction ends, reuse it for later batches
+    cursor.execute(
+        f"CREATE TEMP TABLE IF NOT EXISTS {staging} (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP;"
+    )
+    cursor.execute(f"TRUNCATE {staging};")
+
+    total = 0
+    buf = io.StringIO()
+    for row in rows:
+        buf.write(_csv_row(row))
+        total += 1
+        if total % page_size == 0:
+            _flush(cursor, staging, cols, buf)
+            buf = io.StringIO()
+    _flush(cursor, staging, cols, buf)
+
+    if total:
+        cursor.execute(
+            f"""
+            INSERT INTO {table} ({cols})
+            SELECT DISTINCT ON ({keys}) {cols} FROM {staging}
+            ON CONFLICT ({keys}) {on_conflict};
+            """
+        )
+    return total
+
+
+def _flush(cursor, staging, cols, buf):
+    if not buf.tell():
+        return
+    buf.seek(0)
+    cursor.copy_expert(f"COPY {staging} ({cols}) FROM STDIN WITH (FORMAT csv)", buf)
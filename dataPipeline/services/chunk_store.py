@@ -0,0 +1,66 @@
+import os
+import re
+import shutil
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+STAGING_ROOT = "/opt/airflow/data/staging"
+
+
+def staging_dir(run_id: str) -> str:
+    # run ids look like "manual__2025-01-01T00:00:00+00:00" -> make them path safe
+    safe = re.sub(r"[^A-Za-z0-9_.-]", "_", run_id)
+    path = os.path.join(STAGING_ROOT, safe)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+class ChunkWriter:
+    """
+    Buffers rows (dicts with a fixed set of columns) and writes them out as
+    parquet chunk files of at most rows_per_chunk rows.
+    Only the file paths are meant to travel through XCom.
+    """
+    def __init__(self, out_dir: str, prefix: str, columns, rows_per_chunk: int = 5000):
+        self.out_dir = out_dir
+        self.prefix = prefix
+        self.columns = list(columns)
+        self.rows_per_chunk = rows_per_chunk
+        self.paths = []
+        self.rows = 0
+        self._buffer = []
+
+    def write(self, rows):
+        for row in rows:
+            self._buffer.append(row)
+            self.rows += 1
+            if len(self._buffer) >= self.rows_per_chunk:
+                self._flush()
+
+    def _flush(self):
+        if not self._buffer:
+            return
+        table = pa.table({col: [row.get(col) for row in self._buffer] for col in self.columns})
+        path = os.path.join(self.out_dir, f"{self.prefix}_{len(self.paths):05d}.parquet")
+        pq.write_table(table, path, compression="zstd")
+        self.paths.append(path)
+        self._buffer = []
+
+    def close(self):
+        self._flush()
+        return self.paths
+
+
+def iter_chunks(paths):
+    """Yields one list of row dicts per chunk file, reading files lazily."""
+    for path in paths:
+        yield pq.read_table(path).to_pylist()
+
+
+def iter_rows(paths):
+    for chunk in iter_chunks(paths):
+        yield from chunk
+
+
+def remove_staging(run_id: str):
+    shutil.rmtree(staging_dir(run_id), ignore_errors=True)
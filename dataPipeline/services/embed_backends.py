@@ -0,0 +1,144 @@
+import inspect
+import os
+import torch
+
+# selection by env (set on the airflow workers):
+#   EMBED_BACKEND=torch|onnx, ONNX_QUANTIZE=1, ONNX_THREADS=<intra-op threads>
+#   EMBED_SERVICE_URL=http://127.0.0.1:8765 -> use the resident embed service when it is up
+ONNX_DIR = "/opt/airflow/data/onnx"
+
+
+class TorchBackend:
+    """Eager PyTorch forward pass (default)."""
+    name = "torch"
+
+    def __init__(self, model):
+        self.model = model
+        self.model.eval()
+
+    def last_hidden_state(self, inputs):
+        with torch.inference_mode():
+            return self.model(**inputs).last_hidden_state
+
+
+class _HiddenStateOnly(torch.nn.Module):
+    """Positional (input_ids, attention_mask, token_type_ids) -> last_hidden_state, a stable
+    signature for the tracer whatever keyword arguments BertModel.forward grows"""
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask, token_type_ids):
+        return self.model(input_ids=input_ids, attention_mask=attention_mask,
+                          token_type_ids=token_type_ids).last_hidden_state
+
+
+class OnnxBackend:
+    """
+    ONNX Runtime CPU backend. Exports the BertModel checkpoint to ONNX once
+    (optionally int8 dynamic quantized) and caches the file per model id.
+    load_model is only called when the export has to be (re)built.
+    """
+    def __init__(self, load_model, model_id, quantize=False, threads=None):
+        import onnxruntime as ort
+
+        self.load_model = load_model
+        self.quantize = quantize
+        self.name = "onnx-int8" if quantize else "onnx"
+        path = self._export(model_id)
+
+        opts = ort.SessionOptions()
+        opts.intra_op_num_threads = threads or os.cpu_count() or 1
+        opts.inter_op_num_threads = 1
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(path, opts, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def _export(self, model_id):
+        out_dir = os.path.join(ONNX_DIR, model_id)
+        os.makedirs(out_dir, exist_ok=True)
+        fp32_path = os.path.join(out_dir, "model.onnx")
+        int8_path = os.path.join(out_dir, "model.int8.onnx")
+
+        if not os.path.exists(fp32_path):
+            print(f"[ONNX] exporting BERT to {fp32_path}")
+            dummy = {
+                "input_ids": torch.ones(1, 8, dtype=torch.long),
+                "attention_mask": torch.ones(1, 8, dtype=torch.long),
+                "token_type_ids": torch.zeros(1, 8, dtype=torch.long),
+            }
+            dynamic = {0: "batch", 1: "seq"}
+            # per process temp file, concurrent workers exporting the same model don't clobber each other
+            tmp = f"{fp32_path}.{os.getpid()}.tmp"
+            torch.onnx.export(
+                _HiddenStateOnly(self.load_model().eval()), tuple(dummy.values()), tmp,
+                input_names=list(dummy.keys()),
+                output_names=["last_hidden_state"],
+                dynamic_axes={**{k: dynamic for k in dummy}, "last_hidden_state": dynamic},
+                opset_version=14,
+                # torch >= 2.9 defaults to the dynamo exporter (needs onnxscript, ignores dynamic_axes)
+                **({"dynamo": False} if "dynamo" in inspect.signature(torch.onnx.export).parameters else {}),
+            )
+            os.replace(tmp, fp32_path)
+
+        if not self.quantize:
+            return fp32_path
+        if not os.path.exists(int8_path):
+            from onnxruntime.quantization import quantize_dynamic, QuantType
+            print(f"[ONNX] quantizing to {int8_path}")
+            tmp = f"{int8_path}.{os.getpid()}.tmp"
+            quantize_dynamic(fp32_path, tmp, weight_type=QuantType.QInt8)
+            os.replace(tmp, int8_path)
+        return int8_path
+
+    def last_hidden_state(self, inputs):
+        feeds = {k: v.numpy() for k, v in inputs.items() if k in self.input_names}
+        (hidden,) = self.session.run(["last_hidden_state"], feeds)
+        return torch.from_numpy(hidden)
+
+
+class RemoteBackend:
+    """
+    Forwards batches to the resident embed service (services/embed_service.py).
+    If the service goes away mid-run, inference continues in-process.
+    """
+    def __init__(self, client, load_model, model_id):
+        self.client = client
+        self.name = client.backend_name
+        self._fallback_args = (load_model, model_id)
+        self._fallback = None
+
+    def last_hidden_state(self, inputs):
+        if self._fallback is None:
+            try:
+                return self.client.last_hidden_state(inputs)
+            except OSError as e:
+                print(f"[Embed] service unavailable, falling back to in-process inference: {e}")
+                self._fallback = local_backend(*self._fallback_args)
+        return self._fallback.last_hidden_state(inputs)
+
+
+def local_backend(load_model, model_id):
+    backend = os.getenv("EMBED_BACKEND", "torch").lower()
+    if backend == "onnx":
+        return OnnxBackend(
+            load_model, model_id,
+            quantize=os.getenv("ONNX_QUANTIZE", "0") == "1",
+            threads=int(os.getenv("ONNX_THREADS", "0")) or None,
+        )
+    return TorchBackend(load_model())
+
+
+def get_backend(load_model, model_id):
+    """
+    load_model: callable returning the BertModel, only called if inference runs in this process
+    model_id: checkpoint identity, the remote service must serve the same checkpoint
+    """
+    url = os.getenv("EMBED_SERVICE_URL")
+    if url:
+        from services.embed_service import EmbedClient
+        client = EmbedClient(url)
+        if client.available(model_id):
+            print(f"[Embed] using resident embed service at {url}")
+            return RemoteBackend(client, load_model, model_id)
+    return local_backend(load_model, model_id)
@@ -0,0 +1,99 @@
+import hashlib
+import numpy as np
+from schemas.etl_schema import execute_embed_comments_sql, execute_embed_cache_cols_sql
+from services.bulk_load import copy_merge, pg_vector
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def ensure_schema(cursor):
+    """
+    Creates / migrates airflow.embed_comments. Schema bootstrap: run it in its own short
+    transaction before inference, never in the transaction that holds the cache during run_bert.
+    """
+    cursor.execute(execute_embed_comments_sql)
+    cursor.execute(execute_embed_cache_cols_sql)
+
+
+class EmbeddingCache:
+    """
+    Comment embedding cache backed by airflow.embed_comments.
+    Rows are keyed by (model_id, text_hash), so a different model never matches old vectors.
+    Sentiment labels are only reused while sentiment_model_id matches the classifier that made them.
+    """
+    def __init__(self, cursor, model_id: str, sentiment_model_id: str = None):
+        self.cursor = cursor
+        self.model_id = model_id
+        self.sentiment_model_id = sentiment_model_id
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, texts):
+        """
+        texts: list of cleaned texts -> ({row: vector}, {row: sentiment})
+        for every row already embedded by this model (and classified by this sentiment model),
+        empty or missing labels count as not classified
+        """
+        hashes = [text_hash(t) for t in texts]
+        self.cursor.execute(
+            """
+            SELECT DISTINCT ON (text_hash) text_hash, embedding, sentiment
+            FROM (
+                SELECT text_hash, embedding,
+                       CASE WHEN sentiment_model_id = %s THEN NULLIF(sentiment, '') END AS sentiment
+                FROM airflow.embed_comments
+                WHERE model_id = %s AND text_hash = ANY(%s)
+            ) cached
+            ORDER BY text_hash, sentiment IS NULL;
+            """,
+            (self.sentiment_model_id, self.model_id, list(set(hashes)))
+        )
+        found, labels = {}, {}
+        for h, vec, sentiment in self.cursor.fetchall():
+            # pgvector >= 0.5 returns Vector objects
+            vec = vec.to_numpy() if hasattr(vec, "to_numpy") else vec
+            found[h] = np.asarray(vec, dtype=np.float32)
+            if sentiment:
+                labels[h] = sentiment
+        cached = {row: found[h] for row, h in enumerate(hashes) if h in found}
+        sentiments = {row: labels[h] for row, h in enumerate(hashes) if h in labels}
+        self.hits += len(cached)
+        self.misses += len(hashes) - len(cached)
+        return cached, sentiments
+
+    def store(self, ids, texts, vectors, sentiments=None):
+        """
+        sentiments: labels in ids order, tagged with sentiment_model_id.
+        A missing (None or empty) label keeps the label already cached for the same model.
+        """
+        if sentiments is None:
+            sentiments = [None] * len(ids)
+        rows = [
+            (cid, pg_vector(vec), text_hash(text), self.model_id,
+             sentiment or None, self.sentiment_model_id if sentiment else None)
+            for cid, text, vec, sentiment in zip(ids, texts, vectors, sentiments)
+        ]
+        copy_merge(
+            self.cursor, "airflow.embed_comments",
+            ["comment_id", "embedding", "text_hash", "model_id", "sentiment", "sentiment_model_id"], rows,
+            key_columns=["comment_id"],
+            on_conflict="""DO UPDATE SET embedding = EXCLUDED.embedding, text_hash = EXCLUDED.text_hash,
+                           model_id = EXCLUDED.model_id, embedded_at = now(),
+                           sentiment = CASE WHEN EXCLUDED.sentiment IS NOT NULL THEN EXCLUDED.sentiment
+                                            WHEN embed_comments.model_id = EXCLUDED.model_id
+                                            THEN embed_comments.sentiment END,
+                           sentiment_model_id = CASE WHEN EXCLUDED.sentiment IS NOT NULL
+                                                     THEN EXCLUDED.sentiment_model_id
+                                                     WHEN embed_comments.model_id = EXCLUDED.model_id
+                                                     THEN embed_comments.sentiment_model_id END""",
+        )
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
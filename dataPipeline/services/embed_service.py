@@ -0,0 +1,208 @@
+"""
+Resident embedding service: keeps the BERT model warm in one local process and
+micro-batches concurrent requests coming from several Airflow tasks.
+
+Run it next to the workers (same image, same /bert_model):
+    python -m services.embed_service --host 127.0.0.1 --port 8765
+and point the tasks at it with EMBED_SERVICE_URL=http://127.0.0.1:8765.
+Without the env var (or if the service is down) bert_embed runs in-process as before.
+"""
+import io
+import json
+import os
+import queue
+import threading
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+_INPUT_KEYS = ("input_ids", "attention_mask", "token_type_ids")
+
+
+def _to_npz(arrays: dict) -> bytes:
+    buf = io.BytesIO()
+    np.savez(buf, **arrays)
+    return buf.getvalue()
+
+
+def _from_npz(raw: bytes) -> dict:
+    with np.load(io.BytesIO(raw)) as data:
+        return {k: data[k] for k in data.files}
+
+
+class EmbedClient:
+    def __init__(self, url, timeout=300):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.backend_name = None
+
+    def available(self, model_id=None) -> bool:
+        """True if the service is up (and serves the same checkpoint, when model_id is given)"""
+        try:
+            with urllib.request.urlopen(f"{self.url}/health", timeout=1) as resp:
+                info = json.loads(resp.read())
+        except (OSError, ValueError):
+            return False
+        if model_id is not None and info.get("model_id") != model_id:
+            print(f"[Embed] service serves {info.get('model_id')}, expected {model_id}")
+            return False
+        self.backend_name = info.get("backend")
+        return True
+
+    def _post(self, path, payload) -> dict:
+        req = urllib.request.Request(
+            f"{self.url}{path}",
+            data=json.dumps(payload).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+        )
+        with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+            return _from_npz(resp.read())
+
+    def embed(self, texts):
+        """Mean pooled vectors, (n_texts, hidden)"""
+        return self._post("/embed", {"texts": list(texts)})["vectors"]
+
+    def embed_tokens(self, texts):
+        """Token level vectors, one (n_tokens, hidden) array per text"""
+        out = self._post("/embed_tokens", {"texts": list(texts)})
+        return [out[str(i)] for i in range(len(texts))]
+
+    def last_hidden_state(self, inputs):
+        """Same contract as the in-process backends: padded inputs -> (batch, seq_len, hidden) tensor"""
+        import torch
+        payload = {k: inputs[k].tolist() for k in _INPUT_KEYS if k in inputs}
+        return torch.from_numpy(self._post("/hidden", payload)["hidden"])
+
+
+class MicroBatcher:
+    """
+    Collects rows from concurrent requests for up to max_wait_ms (or max_rows rows)
+    and runs them through the backend as one padded batch.
+    """
+    def __init__(self, tokenizer, backend, max_rows=64, max_wait_ms=10):
+        self.tokenizer = tokenizer
+        self.backend = backend
+        self.max_rows = max_rows
+        self.max_wait = max_wait_ms / 1000
+        self._jobs = queue.Queue()
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def submit(self, rows):
+        """rows: list of {input_ids, attention_mask, token_type_ids} without padding -> list of (len, hidden) arrays"""
+        job = {"rows": rows, "done": threading.Event(), "result": None, "error": None}
+        self._jobs.put(job)
+        job["done"].wait()
+        if job["error"] is not None:
+            raise job["error"]
+        return job["result"]
+
+    def _loop(self):
+        import torch
+        while True:
+            jobs = [self._jobs.get()]
+            n_rows = len(jobs[0]["rows"])
+            while n_rows < self.max_rows:
+                try:
+                    job = self._jobs.get(timeout=self.max_wait)
+                except queue.Empty:
+                    break
+                jobs.append(job)
+                n_rows += len(job["rows"])
+
+            try:
+                rows = [row for job in jobs for row in job["rows"]]
+                inputs = self.tokenizer.pad(rows, return_tensors="pt")
+                with torch.inference_mode():
+                    hidden = self.backend.last_hidden_state(inputs).numpy()
+                i = 0
+                for job in jobs:
+                    job["result"] = [hidden[i + j, :len(row["input_ids"])] for j, row in enumerate(job["rows"])]
+                    i += len(job["rows"])
+            except Exception as e:
+                for job in jobs:
+                    job["error"] = e
+            for job in jobs:
+                job["done"].set()
+
+
+def make_handler(builder, batcher):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, body: bytes, content_type="application/octet-stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _tokenize(self, texts):
+            enc = builder.tokenizer(texts, truncation=True)
+            return [{k: enc[k][i] for k in enc.keys()} for i in range(len(texts))]
+
+        def do_GET(self):
+            if self.path != "/health":
+                return self.send_error(404)
+            info = {"model_id": builder.checkpoint_id, "backend": builder.backend.name}
+            self._send(json.dumps(info).encode("utf-8"), "application/json")
+
+        def do_POST(self):
+            try:
+                payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                if self.path == "/hidden":
+                    seq_len = len(payload["input_ids"][0]) if payload["input_ids"] else 0
+                    # strip the client's padding so rows can be re-batched with other requests
+                    rows = []
+                    for i, mask in enumerate(payload["attention_mask"]):
+                        n = int(sum(mask))
+                        rows.append({k: payload[k][i][:n] for k in _INPUT_KEYS if k in payload})
+                    out = batcher.submit(rows)
+                    hidden = np.zeros((len(rows), seq_len, builder.config.hidden_size), dtype=np.float32)
+                    for i, vecs in enumerate(out):
+                        hidden[i, :len(vecs)] = vecs
+                    body = _to_npz({"hidden": hidden})
+                elif self.path == "/embed":
+                    out = batcher.submit(self._tokenize(payload["texts"]))
+                    vecs = np.stack([v.mean(axis=0) for v in out]) if out else np.zeros((0, builder.config.hidden_size))
+                    body = _to_npz({"vectors": vecs})
+                elif self.path == "/embed_tokens":
+                    out = batcher.submit(self._tokenize(payload["texts"]))
+                    body = _to_npz({str(i): v for i, v in enumerate(out)})
+                else:
+                    return self.send_error(404)
+            except Exception as e:
+                return self.send_error(500, str(e))
+            self._send(body)
+
+        def log_message(self, fmt, *args):
+            pass
+
+    return Handler
+
+
+def make_server(host="127.0.0.1", port=8765, max_rows=64, max_wait_ms=10):
+    """Loads the model and binds the server (port=0 -> any free port, see server.server_address)"""
+    from services.bert_embed import TaxonomyAndTreeBuilder
+
+    # the service itself always runs in-process inference
+    os.environ.pop("EMBED_SERVICE_URL", None)
+    builder = TaxonomyAndTreeBuilder(threshold=0.30, pro_cmts={}, target_words=[])
+    batcher = MicroBatcher(builder.tokenizer, builder.backend, max_rows=max_rows, max_wait_ms=max_wait_ms)
+    server = ThreadingHTTPServer((host, port), make_handler(builder, batcher))
+    host, port = server.server_address[:2]
+    print(f"[Embed] serving {builder.checkpoint_id} ({builder.backend.name}) on {host}:{port}")
+    return server
+
+
+def serve(host="127.0.0.1", port=8765, max_rows=64, max_wait_ms=10):
+    make_server(host, port, max_rows, max_wait_ms).serve_forever()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Resident BERT embedding service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--max-rows", type=int, default=64)
+    parser.add_argument("--max-wait-ms", type=int, default=10)
+    args = parser.parse_args()
+    serve(args.host, args.port, args.max_rows, args.max_wait_ms)
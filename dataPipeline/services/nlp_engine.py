@@ -1,4 +1,7 @@
+import os
 import re
+import hashlib
+from functools import lru_cache
 import nltk
 import torch
 import torch.nn as nn
@@ -7,7 +10,29 @@ from psycopg2.extras import execute_values
 from nltk.stem import WordNetLemmatizer
 from nltk.corpus import stopwords
 import spacy
-noun_nlp = spacy.load("en_core_web_sm")
+
+# merge_ents only reads doc.ents -> skip the components NER doesn't need
+NER_UNUSED = ("tagger", "parser", "attribute_ruler", "lemmatizer", "senter")
+
+@lru_cache(maxsize=1)
+def noun_nlp():
+    # loaded on first use, not on import
+    return spacy.load("en_core_web_sm")
+
+def _ner_unused_pipes():
+    return [p for p in NER_UNUSED if p in noun_nlp().pipe_names]
+
+@lru_cache(maxsize=1)
+def _stopwords():
+    return frozenset(stopwords.words("english"))
+
+@lru_cache(maxsize=1)
+def _lemmatizer():
+    return WordNetLemmatizer()
+
+@lru_cache(maxsize=200000)
+def _lemmatize(word):
+    return _lemmatizer().lemmatize(word)
 
 # --- DYNAMIC ASSET DOWNLOAD (Fixes the LookupError) ---
 # try:
@@ -30,11 +55,37 @@ class SentimentLSTM(nn.Module):
         hidden = torch.cat((hidden[-2,:,:], hidden[-1,:,:]), dim=1)
         return self.softmax(self.fc(hidden))
 
+# sentiment input: the first SENTIMENT_STEPS token states of each comment (after [CLS])
+SENTIMENT_STEPS = 10
+SENTIMENT_LABELS = ("Negative", "Neutral", "Positive")
+
+@lru_cache(maxsize=1)
+def sentiment_model():
+    # trained weights from SENTIMENT_WEIGHTS if given, otherwise a seeded init
+    # so every process/shard (and the embedding cache) agrees on the labels
+    with torch.random.fork_rng():
+        torch.manual_seed(0)
+        model = SentimentLSTM()
+    path = os.getenv("SENTIMENT_WEIGHTS")
+    if path and os.path.exists(path):
+        model.load_state_dict(torch.load(path, map_location="cpu"))
+    return model.eval()
+
+@lru_cache(maxsize=1)
+def sentiment_model_id():
+    """Identity of the labels sentiment_model() gives: hash of the SENTIMENT_WEIGHTS file, or the seeded init"""
+    path = os.getenv("SENTIMENT_WEIGHTS")
+    if not (path and os.path.exists(path)):
+        return "seed0"
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return f"sha1-{h.hexdigest()[:16]}"
+
 class NLPEngine:
     @staticmethod
-    def merge_ents(text: str) -> str:
-        doc = noun_nlp(text)
-    
+    def _merge_doc(doc) -> str:
         # Map start index -> entity span
         start2ent = {ent.start: ent for ent in doc.ents}
     
@@ -52,64 +103,62 @@ class NLPEngine:
         return " ".join(out)
 
     @staticmethod
-    def clean_comments(comment_texts, ids, cursor):
-        lem = WordNetLemmatizer()
-        stops = set(stopwords.words("english"))
-        processed_data = []
-
-        for cid, text in zip(ids, comment_texts):
-            raw = str(text)
+    def merge_ents(text: str) -> str:
+        return NLPEngine._merge_doc(noun_nlp()(text, disable=_ner_unused_pipes()))
 
-            # light cleaning first (keep structure for NER)
-            raw = re.sub(r"http\S+|www\S+|<.*?>", " ", raw)
-            raw = re.sub(r"\s+", " ", raw).strip()
+    @staticmethod
+    def _pre_clean(text) -> str:
+        raw = str(text)
+        # light cleaning first (keep structure for NER)
+        raw = re.sub(r"http\S+|www\S+|<.*?>", " ", raw)
+        return re.sub(r"\s+", " ", raw).strip()
 
-            # merge multi-word entities
-            merged = NLPEngine.merge_ents(raw)
+    @staticmethod
+    def _tokens(merged: str) -> str:
+        stops = _stopwords()
+        # now do your stronger cleanup for tokens
+        clean = merged.lower()
+        clean = re.sub(r"[^a-zA-Z_\s]", " ", clean)  # keep underscores
+        clean = re.sub(r"\s+", " ", clean).strip()
 
-            # now do your stronger cleanup for tokens
-            clean = merged.lower()
-            clean = re.sub(r"[^a-zA-Z_\s]", " ", clean)  # keep underscores
-            clean = re.sub(r"\s+", " ", clean).strip()
+        tokens = [_lemmatize(w) for w in clean.split()
+                  if w not in stops and len(w) > 2]
+        return " ".join(tokens)
 
-            tokens = [lem.lemmatize(w) for w in clean.split()
-                      if w not in stops and len(w) > 2]
+    @staticmethod
+    def clean_comments(comment_texts, ids, cursor, batch_size=256, n_process=1):
+        """
+        Streams all comments through spaCy's nlp.pipe (NER only) in batches.
+        n_process > 1 spreads the batches over worker processes.
+        """
+        raws = [NLPEngine._pre_clean(text) for text in comment_texts]
+        docs = noun_nlp().pipe(raws, batch_size=batch_size, n_process=n_process, disable=_ner_unused_pipes())
 
-            processed_data.append((cid, " ".join(tokens), "Pending"))
+        processed_data = []
+        for cid, doc in zip(ids, docs):
+            # merge multi-word entities
+            merged = NLPEngine._merge_doc(doc)
+            processed_data.append((cid, NLPEngine._tokens(merged), "Pending"))
 
         from schemas.etl_schema import insert_cleaned_comments
         execute_values(cursor, insert_cleaned_comments, processed_data)
         return True
 
     @staticmethod
-    def run_lstm_inference(ids, cursor):
-        """Builds sequences from BERT tables and predicts sentiment."""
-        all_sequences = []
-        for cid in ids:
-            # Reconstructing word sequence using BERT tables
-            cursor.execute("""
-                SELECT wv.word_vec FROM airflow.words_occur wo
-                JOIN airflow.words_vec wv ON wo.word = wv.word AND wo.topic = wv.topic
-                WHERE %s = ANY(wo.word_cmt_ids) LIMIT 10;
-            """, (cid,))
-            vectors = [np.array(row[0]) for row in cursor.fetchall()]
-            
-            while len(vectors) < 10:
-                vectors.append(np.zeros(768))
-            all_sequences.append(vectors[:10])
-
-        X = torch.tensor(np.array(all_sequences), dtype=torch.float32)
-        model = SentimentLSTM() 
-        model.eval()
-        with torch.no_grad():
-            outputs = model(X)
-            predictions = torch.argmax(outputs, dim=1)
-        
-        mapping = {0: "Negative", 1: "Neutral", 2: "Positive"}
-        results = [(mapping[p.item()], cid) for p, cid in zip(predictions, ids)]
+    def classify_hidden(seqs):
+        """(batch, SENTIMENT_STEPS, 768) token states -> one sentiment label per row, single forward pass"""
+        with torch.inference_mode():
+            preds = sentiment_model()(seqs.float()).argmax(dim=1).tolist()
+        return [SENTIMENT_LABELS[p] for p in preds]
 
+    @staticmethod
+    def save_sentiments(cursor, sentiments: dict):
+        """{comment_id: label} -> one bulk UPDATE of cleaned_comments, empty labels are skipped"""
+        rows = [(label, cid) for cid, label in sentiments.items() if label]
+        if not rows:
+            return
         execute_values(cursor, """
             UPDATE airflow.cleaned_comments SET sentiment = val.s
             FROM (VALUES %s) AS val(s, cid)
             WHERE comment_id = val.cid
-        """, results)
\ No newline at end of file
+        """, rows, page_size=len(rows))
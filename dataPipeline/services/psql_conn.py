@@ -1,27 +1,110 @@
+import os
+import threading
+import time
+import weakref
 from contextlib import contextmanager
-from airflow.providers.postgres.hooks.postgres import PostgresHook
+from psycopg2.pool import ThreadedConnectionPool
 from pgvector.psycopg2 import register_vector
 
 POSTGRES_CONN_ID = "postgres_default"
 
+# pool size per process, override with env vars
+POOL_MIN = int(os.getenv("PSQL_POOL_MIN", "1"))
+POOL_MAX = int(os.getenv("PSQL_POOL_MAX", "4"))
+
+# connection extras that are Airflow-only, not libpq params (same list PostgresHook skips)
+_HOOK_ONLY_EXTRAS = {"iam", "redshift", "cursor", "cluster-identifier", "aws_conn_id", "sqlalchemy_scheme"}
+
+_pool = None
+_pool_pid = None
+_slots = None
+# physical connections that already ran register_vector; weak refs, so a connection the pool
+# closes drops out and a new one is never mistaken for it (id() values get reused)
+_registered = weakref.WeakSet()
+_lock = threading.Lock()
+_stats = {"checkouts": 0, "wait_total_s": 0.0, "wait_max_s": 0.0, "new_connections": 0}
+
+
+def _connect_kwargs():
+    # imported here so collectors (and their tests) load without airflow
+    from airflow.providers.postgres.hooks.postgres import PostgresHook
+
+    conn = PostgresHook.get_connection(POSTGRES_CONN_ID)
+    kwargs = {
+        "host": conn.host,
+        "port": conn.port,
+        "user": conn.login,
+        "password": conn.password,
+        "dbname": conn.schema,
+    }
+    for key, val in conn.extra_dejson.items():
+        if key not in _HOOK_ONLY_EXTRAS:
+            kwargs[key] = val
+    return {k: v for k, v in kwargs.items() if v is not None}
+
+
+def _get_pool():
+    global _pool, _pool_pid, _slots
+    with _lock:
+        # forked task processes must not share sockets with the parent -> new pool per pid
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ThreadedConnectionPool(POOL_MIN, POOL_MAX, **_connect_kwargs())
+            _pool_pid = os.getpid()
+            # ThreadedConnectionPool raises when exhausted, the semaphore makes callers wait instead
+            _slots = threading.BoundedSemaphore(POOL_MAX)
+            _registered.clear()
+        return _pool, _slots
+
+
+def pool_stats():
+    """Checkout count and time spent waiting for a free connection in this process."""
+    with _lock:
+        stats = dict(_stats)
+    stats["wait_avg_s"] = stats["wait_total_s"] / stats["checkouts"] if stats["checkouts"] else 0.0
+    return stats
+
+
 @contextmanager
 def psql_cursor():
+    pool, slots = _get_pool()
     conn = None
     cursor = None
-    # to send vec vals, conn needs to be registered
+    broken = False
+
+    start = time.monotonic()
+    slots.acquire()
+    waited = time.monotonic() - start
     try:
-        pg_hook = PostgresHook(postgres_conn_id=POSTGRES_CONN_ID)
-        conn = pg_hook.get_conn()
-        register_vector(conn)
+        conn = pool.getconn()
+        with _lock:
+            _stats["checkouts"] += 1
+            _stats["wait_total_s"] += waited
+            _stats["wait_max_s"] = max(_stats["wait_max_s"], waited)
+
+        # to send vec vals, conn needs to be registered (once per physical connection)
+        if conn not in _registered:
+            register_vector(conn)
+            conn.commit()
+            _registered.add(conn)
+            with _lock:
+                _stats["new_connections"] += 1
+
         cursor = conn.cursor()
         yield cursor
         conn.commit()
     except Exception:
-        if conn:
-            conn.rollback()
+        if conn and not conn.closed:
+            try:
+                conn.rollback()
+            except Exception:
+                broken = True
         raise
     finally:
-        if cursor:
+        if cursor and not cursor.closed:
             cursor.close()
         if conn:
-            conn.close()
+            broken = broken or bool(conn.closed)
+            if broken:
+                _registered.discard(conn)
+            pool.putconn(conn, close=broken)
+        slots.release()
@@ -1,3 +1,4 @@
+import hashlib
 import redis
 
 def get_redis():
@@ -5,4 +6,100 @@ def get_redis():
         host="redis",
         port=6379,
         decode_responses=True # accept normal python strings not raw bytes
-    )
\ No newline at end of file
+    )
+
+# run state only has to outlive one dag run (extract -> load), expire it anyway
+RUN_STATE_TTL = 24 * 60 * 60
+
+
+def run_key(kind, dag_id, run_id):
+    """e.g. processed:genz_dag:manual__2025-01-01T00:00:00+00:00"""
+    return f"{kind}:{dag_id}:{run_id}"
+
+
+def add_run_state(client, dag_id, run_id, state: dict, ttl=RUN_STATE_TTL, batch_size=1000):
+    """
+    state: {kind: iterable of members}, written with pipelined SADD batches + EXPIRE.
+    Keys are scoped per run so concurrent runs of the same dag don't collide.
+    """
+    pipe = client.pipeline(transaction=False)
+    for kind, members in state.items():
+        key = run_key(kind, dag_id, run_id)
+        members = list(members)
+        for i in range(0, len(members), batch_size):
+            pipe.sadd(key, *members[i:i + batch_size])
+        pipe.expire(key, ttl)
+    pipe.execute()
+
+
+def get_run_state(client, dag_id, run_id, kinds):
+    """Returns {kind: set of members} using one round trip"""
+    pipe = client.pipeline(transaction=False)
+    for kind in kinds:
+        pipe.smembers(run_key(kind, dag_id, run_id))
+    return dict(zip(kinds, pipe.execute()))
+
+
+def clear_run_state(client, dag_id, run_id, kinds):
+    client.delete(*[run_key(kind, dag_id, run_id) for kind in kinds])
+
+
+class RedisBloom:
+    """
+    Bloom filter on top of a plain Redis bitmap (SETBIT/GETBIT), so it works
+    without the RedisBloom module. False positives are possible, false negatives are not,
+    as long as the filter was seeded with every item added before it (see seed / is_seeded).
+    """
+    def __init__(self, client, key, size_bits=2**24, n_hashes=7):
+        self.client = client
+        self.key = key
+        self.size_bits = size_bits
+        self.n_hashes = n_hashes
+
+    def _offsets(self, item):
+        # double hashing: h1 + i*h2
+        digest = hashlib.sha1(str(item).encode("utf-8")).digest()
+        h1 = int.from_bytes(digest[:8], "big")
+        h2 = int.from_bytes(digest[8:16], "big") | 1
+        return [(h1 + i * h2) % self.size_bits for i in range(self.n_hashes)]
+
+    def is_seeded(self):
+        # flag bit right after the hash range, in the same key as the bits: a flushed or evicted
+        # filter loses it with them, and a key recreated by add_many alone never has it
+        return bool(self.client.getbit(self.key, self.size_bits))
+
+    def seed(self, items):
+        """Adds items and sets the seeded flag in one MULTI/EXEC"""
+        pipe = self.client.pipeline(transaction=True)
+        for item in items:
+            for off in self._offsets(item):
+                pipe.setbit(self.key, off, 1)
+        pipe.setbit(self.key, self.size_bits, 1)
+        pipe.execute()
+
+    def add_many(self, items):
+        items = list(items)
+        if not items:
+            return
+        pipe = self.client.pipeline(transaction=False)
+        for item in items:
+            for off in self._offsets(item):
+                pipe.setbit(self.key, off, 1)
+        pipe.execute()
+
+    def contains_many(self, items):
+        """Returns {item: bool} -> False means definitely not added"""
+        items = list(items)
+        if not items:
+            return {}
+        pipe = self.client.pipeline(transaction=False)
+        for item in items:
+            for off in self._offsets(item):
+                pipe.getbit(self.key, off)
+        bits = pipe.execute()
+        k = self.n_hashes
+        return {item: all(bits[i * k:(i + 1) * k]) for i, item in enumerate(items)}
+
+
+def processed_bloom(client=None):
+    return RedisBloom(client or get_redis(), "bloom:processed_vidIds")
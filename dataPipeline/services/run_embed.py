@@ -1,8 +1,67 @@
-from services.nlp_engine import NLPEngine
+import numpy as np
+from services.nlp_engine import NLPEngine, sentiment_model_id
 from services.bert_embed import TaxonomyAndTreeBuilder
 from schemas.etl_schema import *
+from services.bulk_load import copy_merge, pg_array, pg_vector
+from services.embed_cache import EmbeddingCache
+from services.psql_conn import psql_cursor
+from services.vocab_miner import update_term_stats, mine_candidates
 
-def create_embeddings(vid_ids, cursor, topic):
+# tree size and number of mined candidate words (embed_dag conf: max_nodes / candidates)
+MAX_TREE_NODES = 20
+CANDIDATES = 200
+
+# used only while a topic has too few comments for mining to return anything
+SEED_TARGET_WORDS = ['protest', 'genz', 'kpoli', 'balenshah', 'corruption', 'singhadurbar', 'gaganthapa', 'youth', 'frustration', 'government', 'nepal', 'political', 'curfew', 'clash', 'rights', 'nepobaby']
+
+def _fetch_cleaned(cursor, ids):
+    """Cleaned text of this run's comments only, in the same order as ids."""
+    cursor.execute(
+        "SELECT comment_id, cleaned_text FROM airflow.cleaned_comments WHERE comment_id = ANY(%s)",
+        (list(ids),)
+    )
+    cleaned = dict(cursor.fetchall())
+    return {cid: cleaned[cid].split() for cid in ids if cid in cleaned}
+
+def _iter_cleaned_chunks(cursor, topic, chunk_size):
+    """Streams every cleaned comment of a topic through a server-side cursor, chunk_size rows at a time."""
+    with cursor.connection.cursor(name="embed_rebuild") as stream:
+        stream.itersize = chunk_size
+        stream.execute(
+            """
+            SELECT cc.comment_id, cc.cleaned_text
+            FROM airflow.cleaned_comments cc
+            JOIN airflow.topic_collector tc ON tc.id = cc.comment_id
+            WHERE tc.topic @> ARRAY[%s]
+            ORDER BY cc.comment_id;
+            """,
+            (topic,)
+        )
+        while True:
+            rows = stream.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield {cid: (text or "").split() for cid, text in rows}
+
+def rebuild_embeddings(cursor, topic, chunk_size=2000):
+    """
+    Full rebuild: re-embeds every cleaned comment of the topic in bounded chunks,
+    so memory depends on chunk_size and not on table size. Only embed_comments is refreshed.
+    """
+    taxTree = TaxonomyAndTreeBuilder(threshold=0.30, pro_cmts={}, target_words=[])
+    # a rebuild always recomputes, the cache is only written
+    embed_cache = EmbeddingCache(cursor, taxTree.model_id)
+    total = 0
+    for chunk in _iter_cleaned_chunks(cursor, topic, chunk_size):
+        taxTree.pro_cmts = chunk
+        comments_vec, _ = taxTree.run_bert()
+        embed_cache.store(list(chunk.keys()), [" ".join(words) for words in chunk.values()], comments_vec)
+        total += len(chunk)
+        print(f"[+] rebuild_embeddings: {total} comments embedded for topic {topic}")
+    return total
+
+def _prepare(vid_ids, cursor, topic, top_k, max_nodes):
+    """Cleans the run's English comments and mines the candidate words -> (proc_cmts, target_words, tree_words) or None"""
     cursor.execute(
     """
         SELECT DISTINCT c.id, c.comment
@@ -24,55 +83,157 @@ def create_embeddings(vid_ids, cursor, topic):
     ids = [_id for(_id, _comment) in rows]
 
     # cleans (preprocesses) the comments and stores them
-    if NLPEngine.clean_comments(comment_texts, ids, cursor):
-        cursor.execute("SELECT comment_id, cleaned_text from airflow.cleaned_comments")
-        rows = cursor.fetchall()
-        proc_cmts = {cid: comment.split() for(cid, comment) in rows}
-
-        target_words = ['protest', 'genz', 'kpoli', 'balenshah', 'corruption', 'singhadurbar', 'gaganthapa', 'youth', 'frustration', 'government', 'nepal', 'political', 'curfew', 'clash', 'rights', 'nepobaby']
-
-        # setting threshold to 0.30 
-        taxTree = TaxonomyAndTreeBuilder(threshold=0.30, pro_cmts=proc_cmts, target_words=target_words) 
-
-        comments_vec, words_occur, word_vectors, word_metadata, imp_score = taxTree.build_tree()
-
-        # ---------- Requirement: Run LSTM FIRST ----------
-        print("[*] Triggering LSTM Sentiment Inference...")
-        try:
-            NLPEngine.run_lstm_inference(ids, cursor)
-        except Exception as e:
-            print(f"[X] LSTM Error: {e}")
-
-        # ---------- Requirement: Create and Save Tree ----------
-        cursor.execute(execute_trees_sql)
-        cursor.execute(execute_tree_nodes_sql)
-        tree, roots = taxTree.create_tree(word_metadata, word_vectors, imp_score, max_nodes=20)
-        taxTree.save_tree(tree, roots, cursor, topic, imp_score, words_occur)
-
-        # ---------- embed_comments ----------
-        comment_embeddings = comments_vec.tolist()
-        cmts_vec_rows = [(cid, emb) for cid, emb in zip(ids, comment_embeddings)]
-
-        # ---------- words_vec (topic, word, word_vec) ----------
-        words_vec_rows = []
-        for word, vec in word_vectors.items():
-            if hasattr(vec, "tolist"):
-                vec = vec.tolist()
-            words_vec_rows.append((topic, word, vec))
-
-        # ---------- words_occur normalized ----------
-        words_occur_rows = [(topic, word, cids) for word, cids in words_occur.items()]
-
-        # insert other features
-        cursor.execute(execute_embed_comments_sql)
-        cursor.execute(execute_words_vec_sql)
-        cursor.execute(execute_words_occur_sql)
-
-        cursor.executemany(insert_embed_comments, cmts_vec_rows)
-        cursor.executemany(insert_words_vec, words_vec_rows)
-        cursor.executemany(insert_words_occur, words_occur_rows)
-        
-        print("[+] BERT Taxonomy and features saved successfully.")
-
-    else:
-        print("[X] NLP Cleaning phase failed. Pipeline aborted.")
\ No newline at end of file
+    if not NLPEngine.clean_comments(comment_texts, ids, cursor):
+        return print("[X] NLP Cleaning phase failed. Pipeline aborted.")
+
+    # only this run's comments, not the whole table
+    proc_cmts = _fetch_cleaned(cursor, ids)
+
+    # candidate vocabulary mined from the topic's comments (term stats updated with this run first)
+    update_term_stats(cursor, topic, proc_cmts)
+    target_words = mine_candidates(cursor, topic, top_k=top_k) or SEED_TARGET_WORDS
+    print(f"[*] {len(target_words)} candidate words for topic {topic}")
+    tree_words = TaxonomyAndTreeBuilder.most_frequent(proc_cmts, target_words, max_nodes)
+    return proc_cmts, target_words, tree_words
+
+def prepare_embeddings(vid_ids, cursor, topic, top_k=CANDIDATES, max_nodes=MAX_TREE_NODES):
+    """
+    Sharded mode, step 1: cleans the run's English comments and mines the candidate words.
+    Returns {"ids": [...], "target_words": [...], "tree_words": [...]} or None if there is nothing to embed,
+    tree_words are the max_nodes candidates that can make it into the tree (only they need token vectors).
+    """
+    prep = _prepare(vid_ids, cursor, topic, top_k, max_nodes)
+    if not prep:
+        return None
+    proc_cmts, target_words, tree_words = prep
+    return {"ids": list(proc_cmts.keys()), "target_words": target_words, "tree_words": tree_words}
+
+def _builder(cursor, proc_cmts, target_words, tree_words=None):
+    # setting threshold to 0.30 
+    taxTree = TaxonomyAndTreeBuilder(threshold=0.30, pro_cmts=proc_cmts, target_words=target_words) 
+    taxTree.tree_words = tree_words
+
+    # reuse embeddings of texts this model has already seen
+    cleaned_texts = [" ".join(words) for words in proc_cmts.values()]
+    embed_cache = EmbeddingCache(cursor, taxTree.model_id, sentiment_model_id())
+    taxTree.cached_vecs, taxTree.cached_sentiments = embed_cache.lookup(cleaned_texts)
+    # sentiment is classified from the same inference batches as the embeddings
+    taxTree.sentiment_classifier = NLPEngine.classify_hidden
+    print(f"[*] Embedding cache: {embed_cache.stats()}")
+    return taxTree, embed_cache, cleaned_texts
+
+def _save_outputs(cursor, taxTree, topic, sentiments, words_occur, word_vectors, word_metadata, imp_score,
+                  max_nodes=MAX_TREE_NODES):
+    # ---------- Requirement: Save LSTM sentiment FIRST (tree nodes read it) ----------
+    NLPEngine.save_sentiments(cursor, sentiments)
+    print(f"[*] LSTM sentiment saved for {len(sentiments)} comments")
+
+    # ---------- Requirement: Create and Save Tree ----------
+    cursor.execute(execute_trees_sql)
+    cursor.execute(execute_tree_nodes_sql)
+    tree, roots = taxTree.create_tree(word_metadata, word_vectors, imp_score, max_nodes=max_nodes)
+    taxTree.save_tree(tree, roots, cursor, topic, imp_score, words_occur)
+
+    # ---------- words_vec (topic, word, word_vec) ----------
+    words_vec_rows = []
+    for word, vec in word_vectors.items():
+        words_vec_rows.append((topic, word, pg_vector(vec)))
+
+    # ---------- words_occur normalized ----------
+    words_occur_rows = [(topic, word, pg_array(cids)) for word, cids in words_occur.items()]
+
+    # insert other features
+    cursor.execute(execute_words_vec_sql)
+    cursor.execute(execute_words_occur_sql)
+
+    copy_merge(cursor, "airflow.words_vec", ["topic", "word", "word_vec"], words_vec_rows,
+               key_columns=["topic", "word"],
+               on_conflict="DO UPDATE SET word_vec = EXCLUDED.word_vec")
+    copy_merge(cursor, "airflow.words_occur", ["topic", "word", "word_cmt_ids"], words_occur_rows,
+               key_columns=["topic", "word"],
+               on_conflict="DO UPDATE SET word_cmt_ids = EXCLUDED.word_cmt_ids")
+    
+    print("[+] BERT Taxonomy and features saved successfully.")
+
+def embed_shard(cursor, ids, target_words, out_path, tree_words=None):
+    """
+    Sharded mode, step 2: embeds one slice of the run's comments and writes the partial
+    results (comment vectors, sentiments, per-word token vector sums/counts, occurrences) to out_path (.npz).
+    """
+    proc_cmts = _fetch_cleaned(cursor, ids)
+    taxTree, embed_cache, cleaned_texts = _builder(cursor, proc_cmts, target_words, tree_words)
+    cmts_vec, target_vecs = taxTree.run_bert()
+
+    cids = list(proc_cmts.keys())
+    sentiments = [taxTree.sentiments.get(row) for row in range(len(cids))]
+
+    # ---------- embed_comments (also the cache for later runs) ----------
+    embed_cache.store(cids, cleaned_texts, cmts_vec, sentiments)
+
+    words = list(target_vecs.keys())
+    occur = taxTree.word_occurrences()
+    occur_pairs = [(word, cid) for word, cids in occur.items() for cid in cids]
+    np.savez(
+        out_path,
+        cids=np.array(cids, dtype=str),
+        cmts_vec=cmts_vec,
+        sentiments=np.array([label or "" for label in sentiments], dtype=str),
+        words=np.array(words, dtype=str),
+        word_sums=np.stack([np.sum([v for _r, v in target_vecs[w]], axis=0) for w in words])
+            if words else np.zeros((0, cmts_vec.shape[1]), dtype=np.float32),
+        word_counts=np.array([len(target_vecs[w]) for w in words], dtype=np.int64),
+        occur_words=np.array([w for w, _c in occur_pairs], dtype=str),
+        occur_cids=np.array([c for _w, c in occur_pairs], dtype=str),
+    )
+    print(f"[+] Shard embedded: {len(proc_cmts)} comments -> {out_path}")
+    return out_path
+
+def finish_embeddings(cursor, topic, target_words, shard_paths, max_nodes=MAX_TREE_NODES, tree_words=None):
+    """Sharded mode, step 3: merges the shard files, scores words, builds and saves the tree."""
+    cids, vecs, sums, counts, occur, sentiments = [], [], {}, {}, {}, {}
+    for path in shard_paths:
+        with np.load(path) as shard:
+            cids.extend(shard["cids"].tolist())
+            sentiments.update((c, s) for c, s in zip(shard["cids"].tolist(), shard["sentiments"].tolist()) if s)
+            vecs.append(shard["cmts_vec"])
+            for word, total, n in zip(shard["words"].tolist(), shard["word_sums"], shard["word_counts"]):
+                sums[word] = sums.get(word, 0) + total
+                counts[word] = counts.get(word, 0) + int(n)
+            for word, cid in zip(shard["occur_words"].tolist(), shard["occur_cids"].tolist()):
+                occur.setdefault(word, []).append(cid)
+    if not cids:
+        return print("finish_embeddings: no shard results")
+
+    cmts_vec = np.concatenate(vecs)
+    mean_vecs = {word: sums[word] / counts[word] for word in sums}
+
+    taxTree = TaxonomyAndTreeBuilder(threshold=0.30, pro_cmts=_fetch_cleaned(cursor, cids), target_words=target_words)
+    taxTree.tree_words = tree_words
+    word_metadata, word_vectors, imp_score = taxTree.score_words(cmts_vec, occur, mean_vecs)
+    _save_outputs(cursor, taxTree, topic, sentiments, occur, word_vectors, word_metadata, imp_score, max_nodes)
+
+def create_embeddings(vid_ids, topic, max_nodes=MAX_TREE_NODES, top_k=CANDIDATES, cursor=psql_cursor):
+    """
+    Non-sharded run. cursor() opens one transaction each for cleaning + mining and for the
+    cache lookup; inference runs with no transaction open, then every write (embed_comments,
+    sentiment, tree, words) goes in one short transaction.
+    """
+    with cursor() as cur:
+        prep = _prepare(vid_ids, cur, topic, top_k, max_nodes)
+    if not prep:
+        return
+    proc_cmts, target_words, tree_words = prep
+
+    with cursor() as cur:
+        taxTree, _embed_cache, cleaned_texts = _builder(cur, proc_cmts, target_words, tree_words)
+    ids = list(proc_cmts.keys())
+
+    comments_vec, words_occur, word_vectors, word_metadata, imp_score = taxTree.build_tree()
+
+    sentiments = {cid: taxTree.sentiments[row] for row, cid in enumerate(ids) if row in taxTree.sentiments}
+
+    with cursor() as cur:
+        # ---------- embed_comments (also the cache for later runs) ----------
+        EmbeddingCache(cur, taxTree.model_id, sentiment_model_id()).store(
+            ids, cleaned_texts, comments_vec, [sentiments.get(cid) for cid in ids])
+        _save_outputs(cur, taxTree, topic, sentiments, words_occur, word_vectors, word_metadata, imp_score, max_nodes)
@@ -0,0 +1,79 @@
+import numpy as np
+from sklearn.feature_extraction.text import CountVectorizer
+from schemas.etl_schema import execute_topic_terms_sql
+from services.bulk_load import copy_merge
+
+
+def update_term_stats(cursor, topic, proc_cmts: dict):
+    """
+    Adds this run's comments to the per-topic document/term frequencies.
+    Comments already counted for the topic are skipped, so re-runs don't inflate the stats.
+    proc_cmts: {comment_id: [cleaned tokens]}
+    """
+    cursor.execute(execute_topic_terms_sql)
+    if not proc_cmts:
+        return 0
+    cursor.execute(
+        """
+        INSERT INTO airflow.topic_term_docs (topic, comment_id)
+        SELECT %s, unnest(%s::text[])
+        ON CONFLICT DO NOTHING
+        RETURNING comment_id;
+        """,
+        (topic, list(proc_cmts.keys())),
+    )
+    new_ids = [row[0] for row in cursor.fetchall()]
+    docs = [proc_cmts[cid] for cid in new_ids if proc_cmts[cid]]
+    if not docs:
+        return 0
+
+    # sparse document-term matrix over the already cleaned tokens
+    vectorizer = CountVectorizer(analyzer=lambda tokens: tokens)
+    dtm = vectorizer.fit_transform(docs)                     # (n_docs, n_terms) csr
+    terms = vectorizer.get_feature_names_out()
+    df = np.asarray((dtm > 0).sum(axis=0)).ravel()
+    tf = np.asarray(dtm.sum(axis=0)).ravel()
+
+    copy_merge(
+        cursor, "airflow.topic_term_stats", ["topic", "term", "df", "tf"],
+        ((topic, term, int(d), int(t)) for term, d, t in zip(terms, df, tf)),
+        key_columns=["topic", "term"],
+        on_conflict="DO UPDATE SET df = topic_term_stats.df + EXCLUDED.df, tf = topic_term_stats.tf + EXCLUDED.tf",
+    )
+    return len(docs)
+
+
+def mine_candidates(cursor, topic, top_k=200, min_df=3, max_df=0.5, max_features=50000):
+    """
+    Top-K candidate words of a topic in one vectorized pass over its term statistics.
+    score = tf * idf, terms in fewer than min_df comments or more than max_df of them are cut,
+    and only the max_features most frequent terms are considered.
+    """
+    cursor.execute(execute_topic_terms_sql)
+    cursor.execute("SELECT count(*) FROM airflow.topic_term_docs WHERE topic = %s;", (topic,))
+    n_docs = cursor.fetchone()[0]
+    if not n_docs:
+        return []
+
+    cursor.execute(
+        """
+        SELECT term, df, tf FROM airflow.topic_term_stats
+        WHERE topic = %s AND df >= %s AND df <= %s
+        ORDER BY tf DESC
+        LIMIT %s;
+        """,
+        (topic, min_df, max(min_df, int(max_df * n_docs)), max_features),
+    )
+    rows = cursor.fetchall()
+    if not rows:
+        return []
+
+    terms = np.array([r[0] for r in rows])
+    df = np.array([r[1] for r in rows], dtype=np.float64)
+    tf = np.array([r[2] for r in rows], dtype=np.float64)
+    # smooth idf, same formula as sklearn's TfidfTransformer
+    scores = tf * (np.log((1 + n_docs) / (1 + df)) + 1)
+
+    k = min(top_k, len(terms))
+    top = np.argpartition(-scores, k - 1)[:k]
+    return terms[top[np.argsort(-scores[top])]].tolist()
@@ -0,0 +1,91 @@
+import os
+import sys
+
+import pytest
+
+# modules import each other as top level packages (collectors., services., schemas.) like inside airflow
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def pg_dsn():
+    """DSN of a scratch postgres (PG_TEST_DSN), for tests that need several connections"""
+    dsn = os.getenv("PG_TEST_DSN")
+    if not dsn:
+        pytest.skip("PG_TEST_DSN not set")
+    pytest.importorskip("psycopg2")
+    return dsn
+
+
+@pytest.fixture
+def pg_cursor(pg_dsn):
+    """Cursor on a scratch postgres given by PG_TEST_DSN, rolled back afterwards"""
+    import psycopg2
+    conn = psycopg2.connect(pg_dsn)
+    try:
+        with conn.cursor() as cursor:
+            yield cursor
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+class FakeRedis:
+    """In-memory stand-in for the redis-py calls the pipeline makes (strings, bitmaps, pipelines)"""
+    def __init__(self):
+        self.data = {}
+
+    def exists(self, *keys):
+        return sum(key in self.data for key in keys)
+
+    def delete(self, *keys):
+        return sum(self.data.pop(key, None) is not None for key in keys)
+
+    def flushall(self):
+        self.data.clear()
+
+    def setbit(self, key, offset, value):
+        bits = self.data.setdefault(key, set())
+        old = int(offset in bits)
+        (bits.add if value else bits.discard)(offset)
+        return old
+
+    def getbit(self, key, offset):
+        return int(offset in self.data.get(key, ()))
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = str(value)
+        return True
+
+    def mget(self, keys):
+        return [self.data.get(key) for key in keys]
+
+    def pipeline(self, transaction=True):
+        return _FakePipeline(self)
+
+
+class _FakePipeline:
+    def __init__(self, client):
+        self.client = client
+        self.queued = []
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+
+        def queue(*args, **kwargs):
+            self.queued.append((method, args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        results = [method(*args, **kwargs) for method, args, kwargs in self.queued]
+        self.queued = []
+        return results
+
+
+@pytest.fixture
+def fake_redis():
+    return FakeRedis()
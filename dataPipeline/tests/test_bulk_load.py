@@ -0,0 +1,37 @@
+from services.bulk_load import _csv_row, copy_merge, pg_array
+
+
+def test_csv_row_null_vs_empty_string():
+    # unquoted empty -> NULL, quoted "" -> ''
+    assert _csv_row(["a", None, ""]) == '"a",,""\n'
+
+
+def test_csv_row_quotes_and_numbers():
+    assert _csv_row(['say "hi", ok', 3, 1.5, "line\nbreak"]) == '"say ""hi"", ok",3,1.5,"line\nbreak"\n'
+
+
+def test_copy_merge_round_trip(pg_cursor):
+    pg_cursor.execute(
+        """
+        CREATE TEMP TABLE bulk_rt (
+            id TEXT PRIMARY KEY,
+            note TEXT,
+            seen_at TIMESTAMPTZ,
+            score DOUBLE PRECISION,
+            tags TEXT[]
+        );
+        """
+    )
+    rows = [
+        ("null", None, None, None, None),
+        ("empty", "", "2025-01-01T00:00:00Z", 0.5, pg_array([])),
+        ("quoted", 'a "b", c\nd', "2025-01-02T00:00:00Z", 1, pg_array(['x"y', "z"])),
+    ]
+    assert copy_merge(pg_cursor, "bulk_rt", ["id", "note", "seen_at", "score", "tags"], rows,
+                      key_columns=["id"]) == 3
+
+    pg_cursor.execute("SELECT id, note, seen_at IS NULL, score, tags FROM bulk_rt ORDER BY id;")
+    got = {row[0]: row[1:] for row in pg_cursor.fetchall()}
+    assert got["null"] == (None, True, None, None)
+    assert got["empty"] == ("", False, 0.5, [])
+    assert got["quoted"] == ('a "b", c\nd', False, 1.0, ['x"y', "z"])
@@ -0,0 +1,90 @@
+"""
+detect_languages: redis / local cache hits, dedup of repeated texts, and the process pool
+giving the same languages as the serial path.
+"""
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+pytest.importorskip("langdetect")
+
+from collectors import cmt_sep_collector
+from collectors.cmt_sep_collector import detect_languages, _text_hash
+
+SENTENCES = [
+    "The protest in the capital was peaceful and the young people demanded change",
+    "नेपालको युवा पुस्ताले भ्रष्टाचारविरुद्ध आन्दोलन गरेको छ",
+    "La manifestación fue pacífica y los jóvenes pidieron un cambio",
+    "Government should listen to the youth before it is too late",
+    "हामीलाई रोजगारी र राम्रो शिक्षा चाहिन्छ",
+]
+
+
+@pytest.fixture(autouse=True)
+def empty_local_cache(monkeypatch):
+    monkeypatch.setattr(cmt_sep_collector, "_local_cache", OrderedDict())
+
+
+@pytest.fixture
+def detect_calls(monkeypatch):
+    calls = []
+    detect = cmt_sep_collector.detect_language
+
+    def counting(text):
+        calls.append(text)
+        return detect(text)
+
+    monkeypatch.setattr(cmt_sep_collector, "detect_language", counting)
+    return calls
+
+
+def test_cache_hits_skip_detection(fake_redis, detect_calls):
+    # a cached answer wins over detection, so a wrong one shows the cache was used
+    fake_redis.set(f"lang:{_text_hash(SENTENCES[0])}", "ne")
+    cmt = {"c1": SENTENCES[0], "c2": SENTENCES[1]}
+
+    assert detect_languages(cmt, redis=fake_redis) == {"c1": "ne", "c2": "ne"}
+    assert detect_calls == [SENTENCES[1]]
+    # the detected one is written back for other workers
+    assert fake_redis.get(f"lang:{_text_hash(SENTENCES[1])}") == "ne"
+
+    # second call: both from the local cache, redis not needed
+    assert detect_languages(cmt) == {"c1": "ne", "c2": "ne"}
+    assert detect_calls == [SENTENCES[1]]
+
+
+def test_repeated_texts_are_detected_once(fake_redis, detect_calls):
+    cmt = {f"c{i}": SENTENCES[i % 3] for i in range(12)}
+
+    langs = detect_languages(cmt, redis=fake_redis)
+
+    assert sorted(detect_calls) == sorted(SENTENCES[:3])
+    assert set(langs) == set(cmt)
+    assert all(langs[f"c{i}"] == ["en", "ne", "rne"][i % 3] for i in range(12))
+    assert sorted(fake_redis.data) == sorted(f"lang:{_text_hash(s)}" for s in SENTENCES[:3])
+
+
+def test_pool_matches_serial(monkeypatch):
+    n = cmt_sep_collector.PARALLEL_MIN_TEXTS + 50
+    # unique texts, so nothing is deduplicated and the pool gets all of them
+    cmt = {f"c{i}": f"{SENTENCES[i % len(SENTENCES)]} {i}" for i in range(n)}
+
+    pools = []
+
+    class CountingPool(ProcessPoolExecutor):
+        def __init__(self, *args, **kwargs):
+            pools.append(kwargs)
+            super().__init__(*args, **kwargs)
+
+    monkeypatch.setattr(cmt_sep_collector, "ProcessPoolExecutor", CountingPool)
+    pooled = detect_languages(cmt, max_workers=2)
+    assert pools == [{"max_workers": 2}]
+
+    monkeypatch.setattr(cmt_sep_collector, "_local_cache", OrderedDict())
+    monkeypatch.setattr(cmt_sep_collector, "PARALLEL_MIN_TEXTS", n + 1)
+    serial = detect_languages(cmt)
+    assert len(pools) == 1
+
+    assert pooled == serial
+    assert set(serial.values()) == {"en", "ne", "rne"}
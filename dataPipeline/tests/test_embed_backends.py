@@ -0,0 +1,81 @@
+"""
+ONNX Runtime backend parity with eager torch (fp32 and int8).
+Uses /bert_model when it is baked into the image, otherwise a small random BERT.
+"""
+import os
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("onnxruntime")
+pytest.importorskip("onnx")
+transformers = pytest.importorskip("transformers")
+
+from services import embed_backends
+from services.embed_backends import OnnxBackend, TorchBackend
+
+MIN_COSINE = 0.99
+
+
+def _load_model():
+    if os.path.exists("/bert_model"):
+        return transformers.BertModel.from_pretrained("/bert_model", local_files_only=True)
+    torch.manual_seed(0)
+    config = transformers.BertConfig(vocab_size=1000, hidden_size=128, num_hidden_layers=2,
+                                     num_attention_heads=4, intermediate_size=256)
+    return transformers.BertModel(config)
+
+
+@pytest.fixture(scope="module")
+def model():
+    return _load_model().eval()
+
+
+@pytest.fixture(scope="module")
+def inputs(model):
+    gen = torch.Generator().manual_seed(1)
+    lengths = [5, 12, 31, 64]
+    ids = torch.randint(5, min(model.config.vocab_size, 1000), (len(lengths), max(lengths)), generator=gen)
+    mask = torch.zeros_like(ids)
+    for i, n in enumerate(lengths):
+        mask[i, :n] = 1
+    ids = ids * mask
+    return {"input_ids": ids, "attention_mask": mask, "token_type_ids": torch.zeros_like(ids)}
+
+
+def _masked_token_cosines(a, b, mask):
+    keep = mask.bool()
+    return torch.nn.functional.cosine_similarity(a[keep], b[keep], dim=-1)
+
+
+def _pooled(hidden, mask):
+    m = mask.unsqueeze(-1)
+    return (hidden * m).sum(dim=1) / m.sum(dim=1)
+
+
+@pytest.mark.parametrize("quantize", [False, True], ids=["fp32", "int8"])
+def test_onnx_matches_torch(model, inputs, quantize, monkeypatch, tmp_path):
+    monkeypatch.setattr(embed_backends, "ONNX_DIR", str(tmp_path))
+    expected = TorchBackend(model).last_hidden_state(inputs)
+    onnx = OnnxBackend(lambda: model, "parity", quantize=quantize, threads=1)
+    got = onnx.last_hidden_state(inputs)
+
+    assert got.shape == expected.shape
+    mask = inputs["attention_mask"]
+    pooled = torch.nn.functional.cosine_similarity(_pooled(got, mask), _pooled(expected, mask), dim=-1)
+    assert pooled.min().item() >= MIN_COSINE
+    tokens = _masked_token_cosines(got, expected, mask)
+    assert tokens.mean().item() >= MIN_COSINE
+    # exported files are in place, no temp files left behind
+    names = os.listdir(os.path.join(tmp_path, "parity"))
+    assert not [n for n in names if ".tmp" in n]
+
+
+def test_export_is_reused(model, monkeypatch, tmp_path):
+    monkeypatch.setattr(embed_backends, "ONNX_DIR", str(tmp_path))
+    OnnxBackend(lambda: model, "reuse", threads=1)
+
+    def fail():
+        raise AssertionError("model reloaded although the export exists")
+
+    OnnxBackend(fail, "reuse", threads=1)
@@ -0,0 +1,150 @@
+import numpy as np
+import pytest
+
+pgvector_psycopg2 = pytest.importorskip("pgvector.psycopg2")
+
+from schemas.etl_schema import execute_cleaned_comments_sql, execute_comments_sql
+from services.embed_cache import EmbeddingCache, ensure_schema
+
+TEXTS = ["good rally today", "curfew again", "nothing new"]
+IDS = [f"ec-test-{i}" for i in range(len(TEXTS))]
+
+
+@pytest.fixture
+def cache_cursor(pg_cursor):
+    pg_cursor.execute("CREATE EXTENSION IF NOT EXISTS vector;")
+    # like psql_cursor() does for pipeline connections
+    pgvector_psycopg2.register_vector(pg_cursor.connection)
+    pg_cursor.execute("CREATE SCHEMA IF NOT EXISTS airflow;")
+    pg_cursor.execute(execute_comments_sql)
+    pg_cursor.execute(execute_cleaned_comments_sql)
+    ensure_schema(pg_cursor)
+    pg_cursor.execute("DELETE FROM airflow.comments WHERE id LIKE 'ec-test-%';")
+    pg_cursor.executemany("INSERT INTO airflow.comments (id, comment) VALUES (%s, %s);", list(zip(IDS, TEXTS)))
+    pg_cursor.executemany("INSERT INTO airflow.cleaned_comments (comment_id, cleaned_text) VALUES (%s, %s);",
+                          list(zip(IDS, TEXTS)))
+    return pg_cursor
+
+
+def _vecs(seed):
+    return np.random.default_rng(seed).normal(size=(len(TEXTS), 768)).astype(np.float32)
+
+
+def test_rebuild_without_labels_keeps_cached_labels(cache_cursor):
+    cache = EmbeddingCache(cache_cursor, "bert-x", "seed0")
+    cache.store(IDS, TEXTS, _vecs(0), ["Positive", None, ""])
+
+    # full rebuild: same model, no sentiment stage
+    vecs = _vecs(1)
+    EmbeddingCache(cache_cursor, "bert-x").store(IDS, TEXTS, vecs)
+
+    cached, labels = EmbeddingCache(cache_cursor, "bert-x", "seed0").lookup(TEXTS)
+    assert sorted(cached) == [0, 1, 2]
+    assert np.allclose(cached[0], vecs[0], atol=1e-6)
+    # the good label survives, missing/empty ones are not cached so they get classified
+    assert labels == {0: "Positive"}
+    cache_cursor.execute("SELECT count(*) FROM airflow.embed_comments WHERE comment_id = ANY(%s) AND sentiment = '';",
+                         (IDS,))
+    assert cache_cursor.fetchone()[0] == 0
+
+    # '' rows written before NULLs were copied correctly don't count as cached either
+    cache_cursor.execute("UPDATE airflow.embed_comments SET sentiment = '' WHERE comment_id = %s;", (IDS[0],))
+    assert EmbeddingCache(cache_cursor, "bert-x", "seed0").lookup(TEXTS)[1] == {}
+
+
+def test_labels_of_another_sentiment_model_are_ignored(cache_cursor):
+    EmbeddingCache(cache_cursor, "bert-x", "seed0").store(IDS, TEXTS, _vecs(0), ["Positive", "Negative", "Neutral"])
+
+    cached, labels = EmbeddingCache(cache_cursor, "bert-x", "sha1-trained").lookup(TEXTS)
+    assert sorted(cached) == [0, 1, 2] and labels == {}
+
+    # relabelled by the new classifier -> reused by it, no longer by the old one
+    EmbeddingCache(cache_cursor, "bert-x", "sha1-trained").store(IDS[:1], TEXTS[:1], _vecs(0)[:1], ["Negative"])
+    assert EmbeddingCache(cache_cursor, "bert-x", "sha1-trained").lookup(TEXTS)[1] == {0: "Negative"}
+    assert EmbeddingCache(cache_cursor, "bert-x", "seed0").lookup(TEXTS)[1] == {1: "Negative", 2: "Neutral"}
+
+
+def test_new_embedding_model_drops_labels(cache_cursor):
+    EmbeddingCache(cache_cursor, "bert-x", "seed0").store(IDS, TEXTS, _vecs(0), ["Positive"] * 3)
+    EmbeddingCache(cache_cursor, "bert-y").store(IDS, TEXTS, _vecs(1))
+
+    cached, labels = EmbeddingCache(cache_cursor, "bert-y", "seed0").lookup(TEXTS)
+    assert sorted(cached) == [0, 1, 2] and labels == {}
+
+
+def test_sentiment_model_id_follows_weights(tmp_path, monkeypatch):
+    nlp_engine = pytest.importorskip("services.nlp_engine")
+    ids = []
+    for weights in (None, b"trained-a", b"trained-b"):
+        if weights is None:
+            monkeypatch.delenv("SENTIMENT_WEIGHTS", raising=False)
+        else:
+            path = tmp_path / "sentiment.pt"
+            path.write_bytes(weights)
+            monkeypatch.setenv("SENTIMENT_WEIGHTS", str(path))
+        nlp_engine.sentiment_model_id.cache_clear()
+        ids.append(nlp_engine.sentiment_model_id())
+    nlp_engine.sentiment_model_id.cache_clear()
+    assert ids[0] == "seed0" and len(set(ids)) == 3
+
+
+@pytest.fixture
+def embed_schema(pg_dsn):
+    """airflow.embed_comments created and committed, as the embed DAG's bootstrap leaves it"""
+    import psycopg2
+    conn = psycopg2.connect(pg_dsn)
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS vector;")
+        cursor.execute("CREATE SCHEMA IF NOT EXISTS airflow;")
+        cursor.execute(execute_comments_sql)
+        cursor.execute(execute_cleaned_comments_sql)
+        ensure_schema(cursor)
+    conn.close()
+    return pg_dsn
+
+
+def test_cache_in_open_transaction_does_not_block_others(embed_schema):
+    import psycopg2
+    holder = psycopg2.connect(embed_schema)
+    other = psycopg2.connect(embed_schema)
+    try:
+        # an embedding run: cache created and looked up, then inference with the transaction open
+        with holder.cursor() as cursor:
+            pgvector_psycopg2.register_vector(holder)
+            EmbeddingCache(cursor, "bert-x", "seed0").lookup(TEXTS)
+        with other.cursor() as cursor:
+            cursor.execute("SET lock_timeout = '1s';")
+            cursor.execute("SELECT count(*) FROM airflow.embed_comments;")
+            # a second shard / run bootstrapping the schema doesn't queue behind it either
+            ensure_schema(cursor)
+        other.commit()
+    finally:
+        holder.rollback()
+        holder.close()
+        other.close()
+
+
+def test_ensure_schema_migrates_old_table(pg_cursor):
+    pg_cursor.execute("CREATE EXTENSION IF NOT EXISTS vector;")
+    pg_cursor.execute("CREATE SCHEMA IF NOT EXISTS airflow;")
+    pg_cursor.execute(execute_comments_sql)
+    pg_cursor.execute(execute_cleaned_comments_sql)
+    # the table as created before the cache columns existed (rolled back afterwards)
+    pg_cursor.execute("DROP TABLE IF EXISTS airflow.embed_comments;")
+    pg_cursor.execute("""
+        CREATE TABLE airflow.embed_comments (
+          comment_id TEXT PRIMARY KEY REFERENCES airflow.cleaned_comments(comment_id) ON DELETE CASCADE,
+          embedding vector(768),
+          embedded_at TIMESTAMPTZ DEFAULT now()
+        );
+    """)
+    ensure_schema(pg_cursor)
+    ensure_schema(pg_cursor)
+    pg_cursor.execute("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = 'airflow' AND table_name = 'embed_comments';
+    """)
+    assert {"text_hash", "model_id", "sentiment", "sentiment_model_id"} <= {r[0] for r in pg_cursor.fetchall()}
+    pg_cursor.execute("SELECT to_regclass('airflow.embed_comments_cache_idx') IS NOT NULL;")
+    assert pg_cursor.fetchone()[0]
@@ -0,0 +1,143 @@
+"""
+Resident embed service on an ephemeral port: /embed, /embed_tokens and /hidden must match
+the in-process backend, and RemoteBackend must fall back to it when the service is gone.
+Uses a small random BERT and a tiny vocab, no checkpoint needed.
+"""
+import socket
+import threading
+
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+
+from services import bert_embed, embed_backends, embed_service
+from services.embed_backends import RemoteBackend, TorchBackend
+from services.embed_service import EmbedClient
+
+VOCAB = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", "protest", "youth", "nepal", "rights", "the",
+         "curfew", "##s", "gen", "##z"]
+TEXTS = ["protest", "the youth protests", "nepal genz rights curfews the protest", "gen", "youth rights"]
+MODEL_ID = "tiny-bert-test"
+
+
+def _model():
+    torch.manual_seed(0)
+    config = transformers.BertConfig(vocab_size=len(VOCAB), hidden_size=32, num_hidden_layers=2,
+                                     num_attention_heads=4, intermediate_size=64)
+    return transformers.BertModel(config).eval()
+
+
+@pytest.fixture(scope="module")
+def tokenizer(tmp_path_factory):
+    folder = tmp_path_factory.mktemp("vocab")
+    (folder / "vocab.txt").write_text("\n".join(VOCAB))
+    # from the folder: transformers 5 ignores a vocab_file= keyword (every word would be [UNK])
+    return transformers.BertTokenizerFast.from_pretrained(str(folder))
+
+
+@pytest.fixture(scope="module")
+def local():
+    return TorchBackend(_model())
+
+
+@pytest.fixture
+def service(tokenizer, monkeypatch):
+    class Builder:
+        """what the service needs from TaxonomyAndTreeBuilder"""
+        checkpoint_id = MODEL_ID
+
+        def __init__(self, threshold, pro_cmts, target_words):
+            self.tokenizer = tokenizer
+            self.backend = TorchBackend(_model())
+            self.config = self.backend.model.config
+
+    monkeypatch.setattr(bert_embed, "TaxonomyAndTreeBuilder", Builder)
+    server = embed_service.make_server("127.0.0.1", 0, max_rows=4, max_wait_ms=20)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host, port = server.server_address[:2]
+    try:
+        yield f"http://{host}:{port}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def _closed_port_url():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    return f"http://127.0.0.1:{port}"
+
+
+def _local_tokens(tokenizer, local, text):
+    enc = tokenizer([text], truncation=True, return_tensors="pt")
+    return local.last_hidden_state(enc)[0].numpy()
+
+
+def test_service_matches_local_backend(service, tokenizer, local):
+    client = EmbedClient(service)
+    assert client.available(MODEL_ID) and client.backend_name == "torch"
+    assert not client.available("another-checkpoint")
+
+    expected_tokens = [_local_tokens(tokenizer, local, text) for text in TEXTS]
+    vectors = client.embed(TEXTS)
+    assert vectors.shape == (len(TEXTS), 32)
+    for got, tokens in zip(vectors, expected_tokens):
+        assert np.allclose(got, tokens.mean(axis=0), atol=1e-5)
+
+    for got, tokens in zip(client.embed_tokens(TEXTS), expected_tokens):
+        assert got.shape == tokens.shape and np.allclose(got, tokens, atol=1e-5)
+
+    # padded batch in, padded batch out: real positions must match the local forward pass
+    inputs = tokenizer(TEXTS, padding=True, truncation=True, return_tensors="pt")
+    got = client.last_hidden_state(inputs)
+    expected = local.last_hidden_state(inputs)
+    mask = inputs["attention_mask"].bool()
+    assert got.shape == expected.shape
+    assert torch.allclose(got[mask], expected[mask], atol=1e-5)
+
+
+def test_concurrent_requests_get_their_own_rows(service, tokenizer, local):
+    # the micro batcher pads rows of different requests into one batch and splits them back
+    results, errors = {}, []
+
+    def call(i):
+        try:
+            results[i] = EmbedClient(service).embed_tokens([TEXTS[i]])[0]
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(len(TEXTS))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(timeout=30)
+    assert not errors and len(results) == len(TEXTS)
+    for i, text in enumerate(TEXTS):
+        assert np.allclose(results[i], _local_tokens(tokenizer, local, text), atol=1e-5)
+
+
+def test_remote_backend_falls_back_when_service_is_down(tokenizer, local, monkeypatch):
+    monkeypatch.setenv("EMBED_BACKEND", "torch")
+    loads = []
+
+    def load_model():
+        loads.append(1)
+        return _model()
+
+    # nothing listens there: get_backend never picks the remote one
+    monkeypatch.setenv("EMBED_SERVICE_URL", _closed_port_url())
+    assert isinstance(embed_backends.get_backend(load_model, MODEL_ID), TorchBackend)
+
+    # service went away after the health check: inference continues in-process, once loaded
+    client = EmbedClient(_closed_port_url(), timeout=2)
+    backend = RemoteBackend(client, load_model, MODEL_ID)
+    inputs = tokenizer(TEXTS, padding=True, truncation=True, return_tensors="pt")
+    loads.clear()
+    for _ in range(2):
+        got = backend.last_hidden_state(inputs)
+        assert torch.allclose(got, local.last_hidden_state(inputs), atol=1e-5)
+    assert len(loads) == 1
@@ -0,0 +1,247 @@
+"""
+Sharded embedding: shards running at the same time, and split -> npz -> finish_embeddings
+giving the same outputs as one shard. BERT is replaced by a small tokenizer and a
+deterministic fake backend (per-token lookup table), so every run embeds identically.
+"""
+import threading
+
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+pgvector_psycopg2 = pytest.importorskip("pgvector.psycopg2")
+
+from schemas.etl_schema import execute_cleaned_comments_sql, execute_comments_sql
+from services import bert_embed, run_embed
+from services.embed_cache import ensure_schema
+
+WORDS = ["protest", "youth", "nepal", "rights", "curfew", "clash", "government", "genz"]
+FILLER = ["the", "a", "today", "people", "city"]
+SPECIAL = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"]
+HIDDEN = 768
+
+
+def _comments(n, prefix, seed=0):
+    rng = np.random.default_rng(seed)
+    vocab = WORDS + FILLER
+    p = np.array([2.0 ** -i for i in range(len(WORDS))] + [1.0] * len(FILLER))
+    return {f"{prefix}{i:03d}": [str(w) for w in rng.choice(vocab, size=rng.integers(3, 9), p=p / p.sum())]
+            for i in range(n)}
+
+
+class _TableBackend:
+    """hidden state = row of a fixed table per token id + position, independent of the batch"""
+    name = "fake"
+    # {thread name: threading.Event} -> inference in that thread waits for the event
+    gates = {}
+
+    def __init__(self, vocab_size):
+        rng = np.random.default_rng(42)
+        self.table = torch.tensor(rng.normal(size=(vocab_size, HIDDEN)), dtype=torch.float32)
+        self.pos = torch.tensor(0.1 * rng.normal(size=(512, HIDDEN)), dtype=torch.float32)
+
+    def last_hidden_state(self, inputs):
+        gate = self.gates.get(threading.current_thread().name)
+        if gate is not None:
+            assert gate.wait(timeout=30)
+        ids = inputs["input_ids"]
+        return self.table[ids] + self.pos[:ids.shape[1]]
+
+
+@pytest.fixture
+def fake_bert(tmp_path, monkeypatch):
+    vocab = tmp_path / "vocab.txt"
+    vocab.write_text("\n".join(SPECIAL + WORDS + FILLER))
+    # from the folder: transformers 5 ignores a vocab_file= keyword (every word would be [UNK])
+    tokenizer = transformers.BertTokenizerFast.from_pretrained(str(tmp_path))
+    config = transformers.BertConfig(hidden_size=HIDDEN)
+
+    class FakeBuilder(bert_embed.TaxonomyAndTreeBuilder):
+        def __init__(self, threshold, pro_cmts, target_words, batch_size=8, memory_budget_mb=1024):
+            self.tokenizer, self.config = tokenizer, config
+            self.model_path, self.is_offline, self._model = str(tmp_path), True, None
+            self.pro_cmts, self.target_words, self.threshold = pro_cmts, target_words, threshold
+            self.batch_size, self.memory_budget_mb = batch_size, memory_budget_mb
+            self.cached_vecs, self.ann_threshold = {}, 2000
+            self.sentiment_classifier, self.sentiment_steps = None, 10
+            self.cached_sentiments, self.sentiments, self.tree_words = {}, {}, None
+            self.backend = _TableBackend(len(SPECIAL + WORDS + FILLER))
+
+    monkeypatch.setattr(run_embed, "TaxonomyAndTreeBuilder", FakeBuilder)
+    monkeypatch.setattr(bert_embed, "STATIC_VEC_DIR", str(tmp_path / "static"))
+    return FakeBuilder
+
+
+def _bootstrap(cursor):
+    cursor.execute("CREATE EXTENSION IF NOT EXISTS vector;")
+    cursor.execute("CREATE SCHEMA IF NOT EXISTS airflow;")
+    cursor.execute(execute_comments_sql)
+    cursor.execute(execute_cleaned_comments_sql)
+    ensure_schema(cursor)
+
+
+def _insert(cursor, cmts):
+    rows = [(cid, " ".join(words)) for cid, words in cmts.items()]
+    cursor.executemany("INSERT INTO airflow.comments (id, comment) VALUES (%s, %s);", rows)
+    cursor.executemany("INSERT INTO airflow.cleaned_comments (comment_id, cleaned_text) VALUES (%s, %s);", rows)
+
+
+def _outputs(cursor, topic):
+    cursor.execute("SELECT word, word_vec FROM airflow.words_vec WHERE topic = %s;", (topic,))
+    vecs = {w: np.asarray(v.to_list() if hasattr(v, "to_list") else v) for w, v in cursor.fetchall()}
+    cursor.execute("SELECT word, word_cmt_ids FROM airflow.words_occur WHERE topic = %s;", (topic,))
+    occur = {w: sorted(c) for w, c in cursor.fetchall()}
+    cursor.execute(
+        """
+        SELECT n.text, p.text, n.imp_val FROM airflow.tree_nodes n
+        JOIN airflow.trees t ON t.id = n.tree_id
+        LEFT JOIN airflow.tree_nodes p ON p.id = n.parent_id
+        WHERE t.name = %s;
+        """,
+        (topic,),
+    )
+    return vecs, occur, sorted(cursor.fetchall())
+
+
+def _run_sharded(cursor, cmts, n_shards, topic, out_dir):
+    ids = list(cmts)
+    tree_words = run_embed.TaxonomyAndTreeBuilder.most_frequent(cmts, WORDS, 5)
+    size = -(-len(ids) // n_shards)
+    paths = [
+        run_embed.embed_shard(cursor, ids[i * size:(i + 1) * size], WORDS,
+                              str(out_dir / f"{topic}_{i}.npz"), tree_words=tree_words)
+        for i in range(n_shards)
+    ]
+    run_embed.finish_embeddings(cursor, topic, WORDS, paths, max_nodes=5, tree_words=tree_words)
+    return paths
+
+
+def test_split_and_merge_match_one_shard(pg_cursor, fake_bert, tmp_path):
+    _bootstrap(pg_cursor)
+    pgvector_psycopg2.register_vector(pg_cursor.connection)
+    pg_cursor.execute("SET LOCAL search_path TO airflow, public;")
+    cmts = _comments(60, "shard-merge-")
+    _insert(pg_cursor, cmts)
+
+    paths = _run_sharded(pg_cursor, cmts, 3, "shard-test-3", tmp_path)
+    pg_cursor.execute("SELECT comment_id, sentiment FROM airflow.cleaned_comments WHERE comment_id = ANY(%s);",
+                      (list(cmts),))
+    labels_sharded = dict(pg_cursor.fetchall())
+    _run_sharded(pg_cursor, cmts, 1, "shard-test-1", tmp_path)
+
+    # npz hand-off: every comment once, in shard order, with its label and word span counts
+    cids, spans = [], 0
+    for path in paths:
+        with np.load(path) as shard:
+            assert shard["cmts_vec"].shape == (len(shard["cids"]), HIDDEN)
+            cids.extend(shard["cids"].tolist())
+            spans += int(shard["word_counts"].sum())
+            assert all(shard["sentiments"])
+    assert cids == list(cmts)
+    tree_words = run_embed.TaxonomyAndTreeBuilder.most_frequent(cmts, WORDS, 5)
+    assert spans == sum(len(set(words) & set(tree_words)) for words in cmts.values())
+
+    vecs3, occur3, nodes3 = _outputs(pg_cursor, "shard-test-3")
+    vecs1, occur1, nodes1 = _outputs(pg_cursor, "shard-test-1")
+    assert occur3 == occur1 and set(occur1) == {w for words in cmts.values() for w in words if w in WORDS}
+    assert set(vecs3) == set(vecs1) == set(tree_words)
+    for word in vecs1:
+        assert np.allclose(vecs3[word], vecs1[word], atol=1e-5)
+    assert nodes3 == nodes1 and len(nodes1) == 5
+    assert all(labels_sharded.values())
+
+
+def test_shards_run_concurrently(pg_dsn, fake_bert, tmp_path):
+    import psycopg2
+    setup = psycopg2.connect(pg_dsn)
+    setup.autocommit = True
+    with setup.cursor() as cursor:
+        _bootstrap(cursor)
+        cursor.execute("DELETE FROM airflow.comments WHERE id LIKE 'shard-conc-%';")
+        cmts = _comments(40, "shard-conc-")
+        _insert(cursor, cmts)
+    ids = list(cmts)
+    halves = {"shard-a": ids[:20], "shard-b": ids[20:]}
+
+    release = threading.Event()
+    _TableBackend.gates = {"shard-a": release}
+    done, errors = {}, {}
+
+    def shard(name):
+        conn = psycopg2.connect(pg_dsn)
+        try:
+            pgvector_psycopg2.register_vector(conn)
+            with conn.cursor() as cursor:
+                # fail fast instead of waiting on another shard's locks
+                cursor.execute("SET lock_timeout = '2s';")
+                run_embed.embed_shard(cursor, halves[name], WORDS, str(tmp_path / f"{name}.npz"))
+            conn.commit()
+            done[name] = True
+        except Exception as e:
+            errors[name] = e
+        finally:
+            conn.close()
+
+    threads = {name: threading.Thread(target=shard, args=(name,), name=name) for name in halves}
+    try:
+        threads["shard-a"].start()
+        # shard a is inside inference with its transaction open, shard b must still run through
+        threads["shard-b"].start()
+        threads["shard-b"].join(timeout=60)
+        assert done.get("shard-b") and not errors, errors
+        assert "shard-a" not in done
+
+        with setup.cursor() as cursor:
+            cursor.execute("SET lock_timeout = '2s';")
+            cursor.execute("SELECT count(*) FROM airflow.embed_comments WHERE comment_id = ANY(%s);", (ids,))
+            assert cursor.fetchone()[0] == 20
+
+        release.set()
+        threads["shard-a"].join(timeout=60)
+        assert done.get("shard-a") and not errors, errors
+    finally:
+        release.set()
+        _TableBackend.gates = {}
+        with setup.cursor() as cursor:
+            cursor.execute("DELETE FROM airflow.comments WHERE id LIKE 'shard-conc-%';")
+        setup.close()
+
+
+def test_unsharded_run_writes_after_inference(pg_cursor, fake_bert, monkeypatch):
+    import contextlib
+    _bootstrap(pg_cursor)
+    pgvector_psycopg2.register_vector(pg_cursor.connection)
+    pg_cursor.execute("SET LOCAL search_path TO airflow, public;")
+    cmts = _comments(30, "unsharded-")
+    _insert(pg_cursor, cmts)
+    # cleaning + mining is covered elsewhere, the run starts from this run's cleaned comments
+    tree_words = run_embed.TaxonomyAndTreeBuilder.most_frequent(cmts, WORDS, 5)
+    monkeypatch.setattr(run_embed, "_prepare", lambda *args: (cmts, WORDS, tree_words))
+
+    transactions, in_transaction = [], []
+
+    @contextlib.contextmanager
+    def cursor():
+        transactions.append(len(transactions))
+        in_transaction.append(True)
+        try:
+            yield pg_cursor
+        finally:
+            in_transaction.pop()
+
+    forward = _TableBackend.last_hidden_state
+
+    def last_hidden_state(self, inputs):
+        assert not in_transaction, "inference ran inside a transaction"
+        return forward(self, inputs)
+
+    monkeypatch.setattr(_TableBackend, "last_hidden_state", last_hidden_state)
+    run_embed.create_embeddings(["vid"], "unsharded-test", max_nodes=5, cursor=cursor)
+
+    # prepare, cache lookup, writes
+    assert transactions == [0, 1, 2]
+    pg_cursor.execute("SELECT count(*) FROM airflow.embed_comments WHERE comment_id = ANY(%s);", (list(cmts),))
+    assert pg_cursor.fetchone()[0] == len(cmts)
+    vecs, occur, nodes = _outputs(pg_cursor, "unsharded-test")
+    assert set(vecs) == set(tree_words) and len(nodes) == 5
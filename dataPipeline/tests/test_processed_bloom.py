@@ -0,0 +1,52 @@
+from contextlib import contextmanager
+
+import pytest
+
+from collectors import base_collector
+from services.redis_client import processed_bloom
+
+
+class _Collector(base_collector.BaseCollector):
+    def fetch_data(self, *args, **kwargs):
+        return []
+
+
+@pytest.fixture
+def collector(pg_cursor, monkeypatch):
+    # processed_vidIds as a temp table, filter_processed's psql_cursor() hands out the test cursor
+    pg_cursor.execute("CREATE TEMP TABLE processed_vidIds (vid_id TEXT NOT NULL, cmt_id TEXT NOT NULL);")
+
+    @contextmanager
+    def cursor():
+        yield pg_cursor
+
+    monkeypatch.setattr(base_collector, "psql_cursor", cursor)
+    return object.__new__(_Collector)
+
+
+def _load(cursor, bloom, vid_ids):
+    # what load_data does: rows committed, then the filter kept warm
+    cursor.executemany("INSERT INTO processed_vidIds VALUES (%s, 'c');", [(v,) for v in vid_ids])
+    bloom.add_many(vid_ids)
+
+
+def test_seeded_filter_answers_like_the_db(collector, pg_cursor, fake_redis):
+    bloom = processed_bloom(fake_redis)
+    _load(pg_cursor, bloom, ["old1", "old2"])
+    assert collector.filter_processed(["old1", "new", "old2"], bloom=bloom) == {"old1", "old2"}
+    assert bloom.is_seeded()
+
+
+def test_load_after_redis_flush_does_not_hide_old_videos(collector, pg_cursor, fake_redis):
+    bloom = processed_bloom(fake_redis)
+    _load(pg_cursor, bloom, ["old1", "old2"])
+    collector.filter_processed(["old1"], bloom=bloom)
+
+    # redis restarts without a volume, then a load runs before the next extract
+    fake_redis.flushall()
+    _load(pg_cursor, bloom, ["batch1"])
+    assert fake_redis.exists(bloom.key) and not bloom.is_seeded()
+
+    # the bare key must not pass as seeded: old videos would test as definitely new
+    assert collector.filter_processed(["old1", "old2", "batch1", "new"], bloom=bloom) == {"old1", "old2", "batch1"}
+    assert bloom.is_seeded()
@@ -0,0 +1,41 @@
+import os
+from contextlib import ExitStack
+
+import pytest
+
+pytest.importorskip("psycopg2")
+pytest.importorskip("pgvector")
+
+from services import psql_conn
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    dsn = os.getenv("PG_TEST_DSN")
+    if not dsn:
+        pytest.skip("PG_TEST_DSN not set")
+    import psycopg2
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS vector;")
+    conn.close()
+
+    monkeypatch.setattr(psql_conn, "_connect_kwargs", lambda: {"dsn": dsn})
+    monkeypatch.setattr(psql_conn, "_pool", None)
+    yield
+    if psql_conn._pool is not None:
+        psql_conn._pool.closeall()
+
+
+def test_every_pooled_connection_decodes_vectors(pool):
+    # the pool closes connections above POOL_MIN on putconn, so each round opens new ones
+    for _ in range(10):
+        with ExitStack() as stack:
+            cursors = [stack.enter_context(psql_conn.psql_cursor()) for _ in range(psql_conn.POOL_MAX)]
+            for cursor in cursors:
+                cursor.execute("SELECT '[1,2,3]'::vector;")
+                vec = cursor.fetchone()[0]
+                assert not isinstance(vec, str)
+                # pgvector < 0.4 decodes to numpy arrays, newer versions to Vector
+                assert list(vec.to_list() if hasattr(vec, "to_list") else vec) == [1, 2, 3]
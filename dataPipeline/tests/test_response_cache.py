@@ -0,0 +1,85 @@
+import os
+
+from collectors import response_cache
+from collectors.response_cache import ResponseCache
+
+
+class _Clock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def _payload(i):
+    # incompressible, so every entry is about the same size on disk
+    return {"items": [os.urandom(1000).hex()], "i": i}
+
+
+def test_ttl_is_per_endpoint(tmp_path, monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(response_cache.time, "time", clock)
+    cache = ResponseCache(str(tmp_path), ttls={"search": 100, "commentThreads": 10})
+    cache.set("search", {"q": "genz"}, {"r": 1})
+    cache.set("commentThreads", {"videoId": "v1"}, {"r": 2})
+
+    clock.now += 50
+    assert cache.get("search", {"q": "genz"}) == {"r": 1}
+    assert cache.get("commentThreads", {"videoId": "v1"}) is None
+    clock.now += 51
+    assert cache.get("search", {"q": "genz"}) is None
+    # expired entries are deleted, and no longer counted
+    assert not os.listdir(tmp_path)
+    assert cache._size == 0
+    assert cache.stats() == {"hits": 1, "misses": 2, "hit_rate": 0.333}
+
+
+def test_lru_eviction_keeps_recently_read(tmp_path, monkeypatch):
+    cache = ResponseCache(str(tmp_path))
+    cache.set("search", {"q": 0}, _payload(0))
+    size = os.path.getsize(cache._path("search", {"q": 0}))
+    cache.max_bytes = int(size * 2.5)
+
+    cache.set("search", {"q": 1}, _payload(1))
+    # distinct mtimes: q=0 oldest, then touched by the read below
+    os.utime(cache._path("search", {"q": 0}), (1, 1))
+    os.utime(cache._path("search", {"q": 1}), (2, 2))
+    assert cache.get("search", {"q": 0})["i"] == 0
+
+    listed = []
+    listdir = os.listdir
+    monkeypatch.setattr(response_cache.os, "listdir", lambda path: listed.append(path) or listdir(path))
+    cache.set("search", {"q": 2}, _payload(2))
+
+    # over budget -> one scan, the least recently used entry (q=1) goes
+    assert len(listed) == 1
+    assert cache.get("search", {"q": 1}) is None
+    assert cache.get("search", {"q": 0})["i"] == 0
+    assert cache.get("search", {"q": 2})["i"] == 2
+    assert cache._size == sum(os.path.getsize(tmp_path / name) for name in listdir(tmp_path))
+
+
+def test_set_under_budget_does_not_scan(tmp_path, monkeypatch):
+    cache = ResponseCache(str(tmp_path))
+
+    def listdir(path):
+        raise AssertionError(f"listed {path} while under budget")
+
+    monkeypatch.setattr(response_cache.os, "listdir", listdir)
+    for i in range(20):
+        cache.set("commentThreads", {"videoId": f"v{i}"}, _payload(i))
+    # overwriting a key replaces its size instead of adding to it
+    cache.set("commentThreads", {"videoId": "v0"}, _payload(0))
+    assert cache._size == sum(entry.stat().st_size for entry in os.scandir(tmp_path))
+
+
+def test_disabled_bypasses_reads_but_refreshes(tmp_path):
+    ResponseCache(str(tmp_path)).set("search", {"q": "genz"}, {"r": "old"})
+
+    disabled = ResponseCache(str(tmp_path), enabled=False)
+    assert disabled.get("search", {"q": "genz"}) is None
+    assert disabled.stats()["misses"] == 0
+    disabled.set("search", {"q": "genz"}, {"r": "new"})
+
+    assert ResponseCache(str(tmp_path)).get("search", {"q": "genz"}) == {"r": "new"}
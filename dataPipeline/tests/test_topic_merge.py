@@ -0,0 +1,66 @@
+"""
+Retagging through copy_merge(on_conflict=merge_topic_on_conflict_sql) must tag rows the same
+way as the old per-row UPDATE loop that used to follow it in load_data.
+Runs on a TEMP topic_collector, which shadows airflow.topic_collector for the unqualified SQL.
+"""
+from schemas.etl_schema import merge_topic_on_conflict_sql
+from services.bulk_load import copy_merge, pg_array
+
+ROWS = {
+    "c1": ["genz"],
+    "c2": ["protest"],
+    "c3": ["protest", "genz"],
+    "c4": ["election", "protest"],
+    "c5": ["other"],            # not re-tagged
+}
+RETAG = ["c1", "c2", "c3", "c4"]
+
+# the per-row update load_data used to run for comments of processed videos
+OLD_UPDATE_SQL = """
+UPDATE topic_collector
+SET topic = ARRAY(
+    SELECT DISTINCT unnest(topic || %s)
+)
+WHERE id = %s;
+"""
+
+
+def _reset(cursor):
+    cursor.execute("DROP TABLE IF EXISTS pg_temp.topic_collector;")
+    cursor.execute("CREATE TEMP TABLE topic_collector (id TEXT PRIMARY KEY, topic TEXT[] NOT NULL);")
+    cursor.executemany("INSERT INTO topic_collector (id, topic) VALUES (%s, %s);", list(ROWS.items()))
+
+
+def _snapshot(cursor):
+    # DISTINCT unnest() gives no order guarantee, compare the tag sets
+    cursor.execute("SELECT id, topic FROM topic_collector;")
+    return {cid: sorted(topic) for cid, topic in cursor.fetchall()}
+
+
+def _merge(cursor, ids, topic):
+    copy_merge(cursor, "topic_collector", ["id", "topic"], [(cid, pg_array([topic])) for cid in ids],
+               key_columns=["id"], on_conflict=merge_topic_on_conflict_sql)
+
+
+def test_merge_retags_like_row_loop(pg_cursor):
+    for topic in ("genz", "protest", "new_topic"):
+        _reset(pg_cursor)
+        for cid in RETAG:
+            pg_cursor.execute(OLD_UPDATE_SQL, ([topic], cid))
+        expected = _snapshot(pg_cursor)
+
+        _reset(pg_cursor)
+        _merge(pg_cursor, RETAG, topic)
+        assert _snapshot(pg_cursor) == expected
+
+        # re-running changes nothing
+        _merge(pg_cursor, RETAG, topic)
+        assert _snapshot(pg_cursor) == expected
+
+
+def test_concurrent_inserts_keep_both_topics(pg_cursor):
+    _reset(pg_cursor)
+    # two runs (genz, protest) both see c9 as a new comment
+    for topic in ("genz", "protest", "genz"):
+        _merge(pg_cursor, ["c9"], topic)
+    assert _snapshot(pg_cursor)["c9"] == ["genz", "protest"]
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+pytest.importorskip("hnswlib")
+
+from services.bert_embed import TaxonomyAndTreeBuilder
+
+
+def _builder(ann_threshold):
+    # only the tree part is exercised, no tokenizer/model needed
+    builder = object.__new__(TaxonomyAndTreeBuilder)
+    builder.pro_cmts = {}
+    builder.threshold = 0.30
+    builder.ann_threshold = ann_threshold
+    return builder
+
+
+def _words(n, dim=64, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(20, dim))
+    vecs = centers[rng.integers(0, 20, n)] + 0.3 * rng.normal(size=(n, dim))
+    words = [f"w{i}" for i in range(n)]
+    metadata = {w: {"abs_score": float(s)} for w, s in zip(words, rng.random(n))}
+    imp = {w: float(s) for w, s in zip(words, rng.random(n))}
+    return dict(zip(words, vecs)), metadata, imp
+
+
+def test_exact_parents_match_pairwise_loop():
+    vecs = TaxonomyAndTreeBuilder._normalize_rows(np.random.default_rng(1).normal(size=(300, 32)))
+    parents, sims = TaxonomyAndTreeBuilder._best_parents(vecs, block=64)
+    for i in range(1, len(vecs)):
+        row = vecs[:i] @ vecs[i]
+        assert parents[i] == row.argmax()
+        assert np.isclose(sims[i], row.max(), atol=1e-5)
+
+
+def test_ann_tree_agrees_with_exact_tree():
+    vectors, metadata, imp = _words(600)
+    exact_tree, exact_roots = _builder(ann_threshold=10**6).create_tree(metadata, vectors, imp, max_nodes=500)
+    ann_tree, ann_roots = _builder(ann_threshold=100).create_tree(metadata, vectors, imp, max_nodes=500)
+
+    assert sum(len(c) for c in exact_tree.values()) + len(exact_roots) == 500
+    parent_of = lambda tree: {c: p for p, children in tree.items() for c in children}
+    exact, ann = parent_of(exact_tree), parent_of(ann_tree)
+    same = sum(ann.get(w) == p for w, p in exact.items())
+    # HNSW is approximate, almost every word must still get the exact parent
+    assert same / max(len(exact), 1) >= 0.95
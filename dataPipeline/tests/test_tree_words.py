@@ -0,0 +1,170 @@
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+
+from services import bert_embed
+from services.bert_embed import TaxonomyAndTreeBuilder
+
+WORDS = ["protest", "youth", "nepal", "rights", "curfew", "clash", "government", "genz"]
+
+
+def _comments(n=200, seed=0):
+    rng = np.random.default_rng(seed)
+    filler = ["the", "a", "today", "people", "city"]
+    vocab = WORDS + filler
+    # skewed word frequencies so the top words are well separated
+    p = np.array([2.0 ** -i for i in range(len(WORDS))] + [1.0] * len(filler))
+    return {f"c{i}": [str(w) for w in rng.choice(vocab, size=rng.integers(3, 9), p=p / p.sum())] for i in range(n)}
+
+
+class _CountingBackend:
+    name = "fake"
+
+    def __init__(self, hidden):
+        self.hidden = hidden
+        self.rows = 0
+
+    def last_hidden_state(self, inputs):
+        ids = inputs["input_ids"]
+        self.rows += ids.shape[0]
+        gen = torch.Generator().manual_seed(int(ids.sum()))
+        return torch.randn(ids.shape[0], ids.shape[1], self.hidden, generator=gen)
+
+
+def _builder(pro_cmts, tmp_path):
+    vocab = tmp_path / "vocab.txt"
+    vocab.write_text("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + WORDS +
+                               ["the", "a", "today", "people", "city"]))
+    builder = object.__new__(TaxonomyAndTreeBuilder)
+    # from the folder: transformers 5 ignores a vocab_file= keyword and falls back to special tokens only
+    builder.tokenizer = transformers.BertTokenizerFast.from_pretrained(str(tmp_path))
+    builder.config = transformers.BertConfig(hidden_size=16)
+    builder.model_path = str(tmp_path)
+    builder.pro_cmts = pro_cmts
+    builder.target_words = WORDS
+    builder.threshold = 0.30
+    builder.ann_threshold = 2000
+    builder.batch_size = 16
+    builder.memory_budget_mb = 1024
+    builder.cached_vecs = {}
+    builder.sentiment_classifier = None
+    builder.cached_sentiments = {}
+    builder.sentiments = {}
+    builder.tree_words = None
+    builder.backend = _CountingBackend(16)
+    return builder
+
+
+@pytest.mark.parametrize("max_nodes", [1, 3, 5, 8])
+def test_most_frequent_is_what_create_tree_keeps(max_nodes):
+    pro_cmts = _comments()
+    builder = object.__new__(TaxonomyAndTreeBuilder)
+    builder.pro_cmts, builder.target_words, builder.threshold, builder.ann_threshold = pro_cmts, WORDS, 0.3, 2000
+    occur = {w: [cid for cid, cmt in pro_cmts.items() if w in cmt] for w in WORDS}
+    imp_score = {w: len(occur[w]) / len(pro_cmts) for w in WORDS}
+    rng = np.random.default_rng(1)
+    vectors = {w: rng.normal(size=8) for w in WORDS}
+    metadata = {w: {"abs_score": float(rng.random())} for w in WORDS}
+
+    tree, _roots = builder.create_tree(metadata, vectors, imp_score, max_nodes=max_nodes)
+    assert set(tree) <= set(TaxonomyAndTreeBuilder.most_frequent(pro_cmts, WORDS, max_nodes))
+
+
+def test_capped_run_reuses_cache_and_keeps_tree(tmp_path, monkeypatch):
+    monkeypatch.setattr(bert_embed, "STATIC_VEC_DIR", str(tmp_path / "static"))
+    pro_cmts = _comments()
+    full = _builder(pro_cmts, tmp_path)
+    cmts_vec, full_occur, _vecs, _meta, full_imp = full.build_tree()
+
+    capped = _builder(pro_cmts, tmp_path)
+    capped.tree_words = TaxonomyAndTreeBuilder.most_frequent(pro_cmts, WORDS, 2)
+    capped.cached_vecs = dict(enumerate(cmts_vec))
+    _cmts, occur, vectors, _meta, imp_score = capped.build_tree()
+
+    # only comments with one of the tree words are run again
+    with_tree_words = sum(1 for cmt in pro_cmts.values() if set(cmt) & set(capped.tree_words))
+    assert capped.backend.rows == with_tree_words < full.backend.rows
+    # importance (and words_occur) still cover every candidate, vectors only the tree words
+    assert imp_score == full_imp and occur == full_occur
+    assert set(vectors) == set(capped.tree_words)
+
+
+@pytest.mark.parametrize("chunk_size", [8192, 7])
+def test_score_abstractness_matches_per_word_formula(chunk_size):
+    cosine_similarity = pytest.importorskip("sklearn.metrics.pairwise").cosine_similarity
+    rng = np.random.default_rng(3)
+    # BERT-like float32 vectors with a shared offset, so similarities are not centred on 0
+    offset = rng.normal(size=768)
+    cmt_vecs = (offset + rng.normal(size=(50, 768))).astype(np.float32)
+    occurrences = [(offset + rng.normal(size=(int(rng.integers(1, 6)), 768))).astype(np.float32) for _ in range(30)]
+    word_vecs = np.stack([occ.mean(axis=0) for occ in occurrences])
+
+    # the per-word loop it replaces: 1 - var(cosine(mean word vector, every comment))
+    expected = [1 - np.var(cosine_similarity([occ.mean(axis=0)], cmt_vecs)[0]) for occ in occurrences]
+
+    got = TaxonomyAndTreeBuilder.score_abstractness(word_vecs, cmt_vecs, chunk_size=chunk_size)
+    assert np.max(np.abs(got - np.asarray(expected))) < 1e-6
+
+
+class _TableBackend:
+    """hidden state = fixed vector per token id + per position, so every token state is known"""
+    name = "fake"
+
+    def __init__(self, vocab_size, hidden):
+        rng = np.random.default_rng(7)
+        self.table = torch.tensor(rng.normal(size=(vocab_size, hidden)), dtype=torch.float32)
+        self.pos = torch.tensor(rng.normal(size=(64, hidden)), dtype=torch.float32)
+
+    def state(self, token_id, position):
+        return (self.table[token_id] + self.pos[position]).numpy()
+
+    def last_hidden_state(self, inputs):
+        ids = inputs["input_ids"]
+        return self.table[ids] + self.pos[:ids.shape[1]]
+
+
+def _wordpiece_builder(pro_cmts, tmp_path, max_length=512):
+    # "genz" and "curfews" are not in the vocab: gen ##z, curfew ##s
+    vocab = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", "the", "protest", "gen", "##z", "curfew", "##s"]
+    (tmp_path / "wordpiece").mkdir()
+    (tmp_path / "wordpiece" / "vocab.txt").write_text("\n".join(vocab))
+    builder = _builder(pro_cmts, tmp_path)
+    builder.tokenizer = transformers.BertTokenizerFast.from_pretrained(str(tmp_path / "wordpiece"),
+                                                                       model_max_length=max_length)
+    builder.target_words = ["genz", "curfews", "protest"]
+    builder.backend = _TableBackend(len(vocab), 16)
+    return builder, {tok: i for i, tok in enumerate(vocab)}
+
+
+def test_multi_piece_word_vector_is_mean_of_its_pieces(tmp_path):
+    pro_cmts = {"c0": ["the", "genz", "curfews", "protest"], "c1": ["protest", "the", "genz"]}
+    builder, vocab = _wordpiece_builder(pro_cmts, tmp_path)
+    _cmts, target_vecs = builder.run_bert()
+    state = builder.backend.state
+    vecs = {word: dict(occ) for word, occ in target_vecs.items()}
+
+    # c0: [CLS] the gen ##z curfew ##s protest [SEP]
+    assert np.allclose(vecs["genz"][0], (state(vocab["gen"], 2) + state(vocab["##z"], 3)) / 2, atol=1e-6)
+    assert np.allclose(vecs["curfews"][0], (state(vocab["curfew"], 4) + state(vocab["##s"], 5)) / 2, atol=1e-6)
+    assert np.allclose(vecs["protest"][0], state(vocab["protest"], 6), atol=1e-6)
+    # c1: [CLS] protest the gen ##z [SEP], padded next to c0 in the same batch
+    assert np.allclose(vecs["genz"][1], (state(vocab["gen"], 3) + state(vocab["##z"], 4)) / 2, atol=1e-6)
+    assert np.allclose(vecs["protest"][1], state(vocab["protest"], 1), atol=1e-6)
+    assert 1 not in vecs["curfews"]
+
+
+def test_truncated_words_keep_only_their_visible_pieces(tmp_path):
+    pro_cmts = {"c0": ["the"] * 5 + ["genz", "protest"], "c1": ["protest", "genz"]}
+    builder, vocab = _wordpiece_builder(pro_cmts, tmp_path, max_length=8)
+    _cmts, target_vecs = builder.run_bert()
+    state = builder.backend.state
+    vecs = {word: dict(occ) for word, occ in target_vecs.items()}
+
+    # c0: [CLS] the x5 gen [SEP] -> ##z and protest are cut off
+    assert np.allclose(vecs["genz"][0], state(vocab["gen"], 6), atol=1e-6)
+    assert 0 not in vecs["protest"]
+    # c1 fits, both words are whole
+    assert np.allclose(vecs["genz"][1], (state(vocab["gen"], 2) + state(vocab["##z"], 3)) / 2, atol=1e-6)
+    assert np.allclose(vecs["protest"][1], state(vocab["protest"], 1), atol=1e-6)